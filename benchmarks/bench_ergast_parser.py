@@ -0,0 +1,130 @@
+"""
+bench_ergast_parser.py
+
+Adquisición de datos - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Integrantes del grupo:
+    - Lydia Ruiz
+    - David Tarrasa
+    - Jorge Vančo
+    - Alberto Velasco
+
+Descripción:
+Comparación del tiempo de lectura de las respuestas de Ergast entre las expresiones regulares línea a línea y ergast_parser.py
+
+Uso: python benchmarks/bench_ergast_parser.py [--repeat R] [--json resultados.json]"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ergast_parser import (
+    parse_drivers_json,
+    parse_drivers_xml,
+    parse_pitstops_json,
+    parse_pitstops_xml,
+)
+
+
+fixtures_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Regular expressions used by ergast_pitstops_data.py before ergast_parser.py
+patron_pitstop = re.compile(
+    r'<PitStop driverId="(\w+)" stop="(\d+)" lap="(\d+)" time="(\d+:\d+:\d+)" duration="([\d:|]+\d+\.\d+)"\/>'
+)
+patron_driverid = re.compile(r'<Driver driverId="([\w]+)"')
+patron_drivernumber = re.compile(r"<PermanentNumber>([\d]+)<\/PermanentNumber>")
+
+
+def regex_pitstops(contenido):
+    """
+    Function that reproduces the previous per-line regex parsing of the pitstops.
+    """
+    pitstops = []
+    for linea in contenido.decode("utf-8").split("\n"):
+        bus = re.search(patron_pitstop, linea)
+        if bus != None:
+            pitstops.append(bus.groups())
+    return pitstops
+
+
+def regex_drivers(contenido):
+    """
+    Function that reproduces the previous two-state line machine of the driver list.
+    """
+    pilotos = []
+    estado = 0
+    for linea in contenido.decode("utf-8").split("\n"):
+        if estado == 0:
+            busqueda = re.search(patron_driverid, linea)
+            if busqueda != None:
+                nombre_piloto = busqueda.group(1)
+                estado = 1
+        elif estado == 1:
+            busqueda = re.search(patron_drivernumber, linea)
+            numero = busqueda.group(1) if busqueda != None else "-1"
+            pilotos.append((nombre_piloto, numero))
+            estado = 0
+    return pilotos
+
+
+def read_fixture(name):
+    """
+    Function that reads a fixture payload as bytes.
+    """
+    with open(os.path.join(fixtures_path, name), "rb") as f:
+        return f.read()
+
+
+def bench(resultados, name, func, contenido, repeticiones):
+    """
+    Function that records and prints the mean time per payload of a parser.
+    """
+    n = len(list(func(contenido)))
+    segundos = timeit.timeit(lambda: list(func(contenido)), number=repeticiones)
+    resultados.append(
+        {
+            "stage": name,
+            "records": n,
+            "seconds_per_payload": segundos / repeticiones,
+        }
+    )
+    print(
+        f"{name:<28} {n:>5} records {segundos / repeticiones * 1e6:>10.1f} us/payload"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the Ergast parsers")
+    parser.add_argument(
+        "--repeat", type=int, default=2000, help="parses of each payload"
+    )
+    parser.add_argument("--json", metavar="PATH", help="save the results to a file")
+    args = parser.parse_args()
+
+    pitstops_xml = read_fixture("ergast_pitstops_2023_1.xml")
+    pitstops_json = read_fixture("ergast_pitstops_2023_1.json")
+    drivers_xml = read_fixture("ergast_drivers_2023.xml")
+    drivers_json = read_fixture("ergast_drivers_2023.json")
+
+    resultados = []
+    casos = [
+        ("pitstops xml (regex)", regex_pitstops, pitstops_xml),
+        ("pitstops xml (pull parser)", parse_pitstops_xml, pitstops_xml),
+        ("pitstops json", parse_pitstops_json, pitstops_json),
+        ("drivers xml (regex)", regex_drivers, drivers_xml),
+        ("drivers xml (pull parser)", parse_drivers_xml, drivers_xml),
+        ("drivers json", parse_drivers_json, drivers_json),
+    ]
+    for name, func, contenido in casos:
+        bench(resultados, name, func, contenido, args.repeat)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"repeat": args.repeat, "stages": resultados}, f, indent=4)
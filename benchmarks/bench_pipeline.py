@@ -0,0 +1,238 @@
+"""
+bench_pipeline.py
+
+Adquisición de datos - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Integrantes del grupo:
+    - Lydia Ruiz
+    - David Tarrasa
+    - Jorge Vančo
+    - Alberto Velasco
+
+Descripción:
+Pruebas de rendimiento de cada etapa del proyecto con las respuestas grabadas en benchmarks/fixtures, servidas por
+benchmarks/stub_server.py. El factor de escala sintetiza 12 temporadas por unidad para ver cómo crece cada etapa
+
+Uso: python benchmarks/bench_pipeline.py [--scale N] [--repeat R] [--json resultados.json]"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import urllib.request
+
+benchmarks_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchmarks_path, ".."))
+sys.path.insert(0, benchmarks_path)
+
+from scrapy.http import HtmlResponse, Request
+
+import dataframe
+import ergast_pitstops_data
+import formula1_spider
+import graphs
+from stub_server import Fixtures, start_server
+
+
+# Seasons synthesised by each unit of the scale factor (as many as 2012-2023).
+TEMPORADAS_POR_ESCALA = 12
+ULTIMA_TEMPORADA = 2023
+
+
+def bench(resultados, nombre, func, unidades, repeticiones=1):
+    """
+    Function that runs func several times and records the best time and the throughput of a stage.
+    """
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = func()
+        tiempos.append(time.perf_counter() - inicio)
+    segundos = min(tiempos)
+    resultados.append(
+        {
+            "stage": nombre,
+            "seconds": segundos,
+            "units": unidades,
+            "units_per_second": unidades / segundos if segundos else None,
+        }
+    )
+    print(
+        f"{nombre:<36} {segundos:>9.3f} s {unidades:>8} units {unidades / segundos:>12.1f} units/s"
+    )
+    return resultado
+
+
+def race_responses(fixtures, seasons):
+    """
+    Function that builds the race report responses of every race of the seasons, as the spider receives them.
+    """
+    responses = []
+    for season in seasons:
+        body = fixtures.race_page(str(season)).encode("utf-8")
+        for race in range(1, races_per_season(fixtures) + 1):
+            url = f"{formula1_spider.WIKIPEDIA_URL}/{season}_Race_{race}_Grand_Prix"
+            request = Request(url, meta={"race_number": race, "season": str(season)})
+            responses.append(
+                HtmlResponse(url, body=body, encoding="utf-8", request=request)
+            )
+    return responses
+
+
+def races_per_season(fixtures):
+    """
+    Function that returns the number of races of the recorded season page.
+    """
+    return fixtures.season.count(">Report</a>")
+
+
+def check_stub_races(spider, url, fixtures, season):
+    """
+    Function that checks that the stub server answers every race report linked from its season page,
+    so the benchmark runs on as many races as races_per_season says.
+    """
+    season_url = f"{url}/wiki/{season}_Formula_One_World_Championship"
+    with urllib.request.urlopen(season_url) as respuesta:
+        response = HtmlResponse(season_url, body=respuesta.read(), encoding="utf-8")
+    requests = list(spider.parse(response))
+    assert len(requests) == races_per_season(fixtures), len(requests)
+    for request in requests:
+        with urllib.request.urlopen(request.url) as respuesta:
+            assert respuesta.status == 200, request.url
+
+
+def parse_reports(spider, responses):
+    """
+    Function that extracts the items of every race report response.
+    """
+    return [item for response in responses for item in spider.parse_report(response)]
+
+
+def store_items(items):
+    """
+    Function that sends the items through the item pipeline, writing the results store.
+    """
+    pipeline = formula1_spider.RaceResultsPipeline(
+        dataframe.dataset_path(dataframe.spider_store_path), "csv", 500
+    )
+    pipeline.open_spider()
+    for item in items:
+        pipeline.process_item(item)
+    pipeline.close_spider()
+    pipeline.publish("finished")
+
+
+def fetch_races(races, sesion):
+    """
+    Function that retrieves the pitstops of every race with conseguir_pitstops_año_carrera.
+    """
+    for season, race in races:
+        ergast_pitstops_data.conseguir_pitstops_año_carrera(
+            season, race, update=True, sesion=sesion
+        )
+
+
+def chart_aggregates(df):
+    """
+    Function that computes the aggregate cube and the aggregates of every chart.
+    """
+    cube = graphs.AggregateCube(df)
+    return [aggregate(cube) for aggregate, _, _ in graphs.CHARTS.values()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the pipeline")
+    parser.add_argument("--scale", type=int, default=1, help="12 seasons per unit")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each stage")
+    parser.add_argument("--json", metavar="PATH", help="save the results to a file")
+    args = parser.parse_args()
+
+    seasons = range(
+        ULTIMA_TEMPORADA + 1 - TEMPORADAS_POR_ESCALA * args.scale, ULTIMA_TEMPORADA + 1
+    )
+    fixtures = Fixtures()
+    races = [
+        (season, race)
+        for season in seasons
+        for race in range(1, races_per_season(fixtures) + 1)
+    ]
+    print(f"{len(seasons)} seasons, {len(races)} races\n")
+
+    # Every stage writes to ./cache, so the benchmark runs in a temporary directory
+    json_path = os.path.abspath(args.json) if args.json else None
+    directorio = tempfile.TemporaryDirectory()
+    os.chdir(directorio.name)
+    server = start_server()
+    url = f"http://127.0.0.1:{server.server_port}"
+    formula1_spider.WIKIPEDIA_URL = f"{url}/wiki"
+    ergast_pitstops_data.ERGAST_URL = f"{url}/api/f1"
+
+    resultados = []
+    responses = race_responses(fixtures, seasons)
+    spider = formula1_spider.F1Scraper(seasons=[])
+    check_stub_races(spider, url, fixtures, seasons[-1])
+    items = bench(
+        resultados,
+        "spider.parse_report",
+        lambda: parse_reports(spider, responses),
+        len(responses),
+        args.repeat,
+    )
+    bench(resultados, "spider.pipeline", lambda: store_items(items), len(items))
+
+    sesion = ergast_pitstops_data.crear_sesion()
+    bench(
+        resultados,
+        "ergast.race (stub server)",
+        lambda: fetch_races(races, sesion),
+        len(races),
+    )
+    bench(
+        resultados,
+        "ergast.race (http cache)",
+        lambda: fetch_races(races, sesion),
+        len(races),
+        args.repeat,
+    )
+    bench(
+        resultados,
+        "crear_csv_dataframes_intervalos",
+        lambda: ergast_pitstops_data.crear_csv_dataframes_intervalos(
+            seasons[0], seasons[-1]
+        ),
+        len(races),
+        args.repeat,
+    )
+
+    df1 = bench(resultados, "get_df", dataframe.get_df, len(races), args.repeat)
+    df_procesado = bench(
+        resultados, "get_procesado", dataframe.get_procesado, len(races), args.repeat
+    )
+    df = bench(
+        resultados,
+        "merge_dfs",
+        lambda: dataframe.merge_dfs(df1, df_procesado),
+        len(races),
+        args.repeat,
+    )
+    bench(
+        resultados,
+        "graphs aggregates",
+        lambda: chart_aggregates(df),
+        len(df),
+        args.repeat,
+    )
+
+    server.shutdown()
+    os.chdir(benchmarks_path)
+    directorio.cleanup()
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"seasons": len(seasons), "races": len(races), "stages": resultados},
+                f,
+                indent=4,
+            )
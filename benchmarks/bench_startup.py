@@ -0,0 +1,86 @@
+"""
+bench_startup.py
+
+Adquisición de datos - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Integrantes del grupo:
+    - Lydia Ruiz
+    - David Tarrasa
+    - Jorge Vančo
+    - Alberto Velasco
+
+Descripción:
+Medición del tiempo de arranque de main.py y de los módulos pesados que carga cada subcomando
+
+Uso: python benchmarks/bench_startup.py [repeticiones]"""
+
+import os
+import subprocess
+import sys
+import time
+
+
+repo_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Heavy dependencies that should only be imported by the subcommands that need them.
+MODULOS_PESADOS = ["pandas", "numpy", "pyarrow", "scrapy", "twisted", "matplotlib"]
+
+# Module imported by each subcommand of main.py.
+MODULOS_SUBCOMANDOS = {
+    "main": "main",
+    "merge": "dataframe",
+    "plot": "graphs",
+    "fetch-pitstops": "ergast_pitstops_data",
+    "crawl": "formula1_spider",
+}
+
+
+def run(args):
+    """
+    Function that runs a python process in the repository and returns its output.
+    """
+    return subprocess.run(
+        [sys.executable] + args,
+        cwd=repo_path,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+
+
+def bench(name, args, repeticiones):
+    """
+    Function that prints the best wall time of a python process, including the interpreter startup.
+    """
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        run(args)
+        tiempos.append(time.perf_counter() - inicio)
+    print(f"{name:<36} {min(tiempos) * 1000:>8.1f} ms")
+
+
+def heavy_modules(module):
+    """
+    Function that returns the heavy dependencies loaded when a module is imported.
+    """
+    codigo = (
+        f"import sys, {module}; "
+        f"print(' '.join(m for m in {MODULOS_PESADOS} if m in sys.modules))"
+    )
+    return run(["-c", codigo]).split()
+
+
+if __name__ == "__main__":
+    repeticiones = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    bench("python (interpreter only)", ["-c", "pass"], repeticiones)
+    bench("python main.py --help", ["main.py", "--help"], repeticiones)
+    bench("python main.py merge --help", ["main.py", "merge", "--help"], repeticiones)
+    for subcomando, modulo in MODULOS_SUBCOMANDOS.items():
+        bench(f"import {modulo}", ["-c", f"import {modulo}"], repeticiones)
+
+    print()
+    for subcomando, modulo in MODULOS_SUBCOMANDOS.items():
+        print(f"{subcomando:<16} {', '.join(heavy_modules(modulo)) or '-'}")
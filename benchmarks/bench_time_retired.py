@@ -0,0 +1,151 @@
+"""
+bench_time_retired.py
+
+Adquisición de datos - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Integrantes del grupo:
+    - Lydia Ruiz
+    - David Tarrasa
+    - Jorge Vančo
+    - Alberto Velasco
+
+Descripción:
+Prueba de rendimiento de la conversión de la columna Time/Retired (parse_time_retired) sobre una tabla sintética de
+resultados de varias temporadas, comparada con la conversión fila a fila
+
+Uso: python benchmarks/bench_time_retired.py [--seasons N] [--repeat R] [--json resultados.json]"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+import pandas as pd
+
+from dataframe import parse_time_retired, patron_nota, patron_time_retired
+
+
+CARRERAS_POR_TEMPORADA = 22
+PILOTOS_POR_CARRERA = 20
+MOTIVOS = ["Engine", "Collision", "Gearbox", "Accident", "Brakes", "Retired", "DNS"]
+
+
+def synthetic_time_retired(seasons, seed=0):
+    """
+    Function that builds the Time/Retired column of a results table: the winner's time, gaps,
+    laps down and retirements, in the proportions of a typical race.
+    """
+    rng = np.random.default_rng(seed)
+    textos = []
+    for _ in range(seasons * CARRERAS_POR_TEMPORADA):
+        segundos = rng.uniform(5200, 7200)
+        textos.append(
+            f"{int(segundos // 3600)}:{int(segundos % 3600 // 60):02d}:{segundos % 60:06.3f}"
+        )
+        for gap in np.sort(rng.uniform(0.1, 95, 11)):
+            minutos, resto = divmod(gap, 60)
+            textos.append(
+                f"+{int(minutos)}:{resto:06.3f}" if minutos else f"+{gap:.3f}"
+            )
+        for vueltas in rng.integers(1, 4, 4):
+            textos.append(f"+{vueltas} Lap" + ("s" if vueltas > 1 else ""))
+        for motivo in rng.choice(MOTIVOS, PILOTOS_POR_CARRERA - 16):
+            textos.append(motivo + ("[a]" if rng.random() < 0.1 else ""))
+    return pd.Series(textos, dtype="string")
+
+
+def parse_time_retired_rows(values):
+    """
+    Function that converts the Time/Retired column row by row, as a reference for the vectorized version.
+    """
+    patron = re.compile(patron_time_retired, re.IGNORECASE)
+
+    def convertir(texto):
+        texto = re.sub(patron_nota, "", texto).strip()
+        busqueda = patron.match(texto)
+        if busqueda is None:
+            return np.nan, pd.NA, texto
+        partes = busqueda.groupdict()
+        if partes["minutos"] is not None:
+            return 0.0, 0, None
+        if partes["vueltas"] is not None:
+            return np.nan, int(partes["vueltas"]), None
+        return (
+            float(partes["minutos_gap"] or 0) * 60 + float(partes["segundos_gap"]),
+            0,
+            None,
+        )
+
+    return pd.DataFrame(
+        list(values.map(convertir)),
+        columns=["GapSeconds", "LapsDown", "RetirementReason"],
+    )
+
+
+def bench(resultados, nombre, func, filas, repeticiones):
+    """
+    Function that records the best time of several runs of func and its throughput in rows per second.
+    """
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = func()
+        tiempos.append(time.perf_counter() - inicio)
+    segundos = min(tiempos)
+    resultados.append(
+        {
+            "stage": nombre,
+            "seconds": segundos,
+            "rows": filas,
+            "rows_per_second": filas / segundos,
+        }
+    )
+    print(f"{nombre:<28} {segundos:>9.3f} s {filas / segundos:>14,.0f} rows/s")
+    return resultado
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of parse_time_retired")
+    parser.add_argument("--seasons", type=int, default=74, help="seasons of the table")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each version")
+    parser.add_argument("--json", metavar="PATH", help="save the results to a file")
+    args = parser.parse_args()
+
+    valores = synthetic_time_retired(args.seasons)
+    print(
+        f"{args.seasons} seasons, {len(valores)} rows, {valores.nunique()} distinct texts\n"
+    )
+
+    resultados = []
+    vectorizado = bench(
+        resultados,
+        "parse_time_retired",
+        lambda: parse_time_retired(valores),
+        len(valores),
+        args.repeat,
+    )
+    por_filas = bench(
+        resultados,
+        "row by row",
+        lambda: parse_time_retired_rows(valores),
+        len(valores),
+        args.repeat,
+    )
+
+    # Both versions must give the same gaps and laps down
+    assert np.allclose(
+        vectorizado["GapSeconds"], por_filas["GapSeconds"].astype(float), equal_nan=True
+    )
+    assert (
+        vectorizado["LapsDown"].fillna(-1) == por_filas["LapsDown"].fillna(-1)
+    ).all()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"rows": len(valores), "stages": resultados}, f, indent=4)
@@ -0,0 +1,205 @@
+"""
+stub_server.py
+
+Adquisición de datos - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Integrantes del grupo:
+    - Lydia Ruiz
+    - David Tarrasa
+    - Jorge Vančo
+    - Alberto Velasco
+
+Descripción:
+Servidor HTTP local que sirve las páginas de Wikipedia y las respuestas de Ergast grabadas en benchmarks/fixtures
+para cualquier temporada, de modo que las pruebas de rendimiento no dependen de la red
+
+Uso: python benchmarks/stub_server.py [puerto]"""
+
+import json
+import os
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+fixtures_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Season of the recorded pages, replaced by the season requested.
+TEMPORADA_FIXTURES = "2023"
+
+patron_temporada = re.compile(r"/wiki/(\d{4})_Formula_One_World_Championship$")
+patron_carrera = re.compile(r"/wiki/(\d{4})_\w+_Grand_Prix$")
+patron_pitstops = re.compile(r"/api/f1/(\d{4})/(\d+)/pitstops\.json$")
+patron_pilotos = re.compile(r"/api/f1/(\d{4})/drivers\.json$")
+patron_vueltas = re.compile(r"/api/f1/(\d{4})/(\d+)/laps\.json$")
+patron_calendario = re.compile(r"/api/f1/(\d{4})\.json$")
+
+
+def read_fixture(name):
+    """
+    Function that reads a recorded payload of benchmarks/fixtures.
+    """
+    with open(os.path.join(fixtures_path, name), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+class Fixtures:
+    """
+    Class that builds the responses of any season and race from the recorded payloads.
+    """
+
+    def __init__(self):
+        self.season = read_fixture(f"wikipedia_{TEMPORADA_FIXTURES}_season.html")
+        self.race = read_fixture(f"wikipedia_{TEMPORADA_FIXTURES}_race.html")
+        self.drivers = json.loads(
+            read_fixture(f"ergast_drivers_{TEMPORADA_FIXTURES}.json")
+        )
+        self.pitstops = json.loads(
+            read_fixture(f"ergast_pitstops_{TEMPORADA_FIXTURES}_1.json")
+        )
+        self.laps = json.loads(read_fixture(f"ergast_laps_{TEMPORADA_FIXTURES}_1.json"))
+        self.schedule = read_fixture(f"ergast_schedule_{TEMPORADA_FIXTURES}.json")
+
+    def season_page(self, season):
+        """
+        Method that returns the season page with the links to the race reports of the season.
+        """
+        return self.season.replace(TEMPORADA_FIXTURES, season)
+
+    def race_page(self, season):
+        """
+        Method that returns the race report page of a season.
+        """
+        return self.race.replace(TEMPORADA_FIXTURES, season)
+
+    def drivers_json(self, season):
+        """
+        Method that returns the Ergast driver list of a season.
+        """
+        datos = json.loads(json.dumps(self.drivers))
+        datos["MRData"]["DriverTable"]["season"] = season
+        return json.dumps(datos)
+
+    def schedule_json(self, season):
+        """
+        Method that returns the Ergast schedule of a season, with the dates moved to that season.
+        """
+        return self.schedule.replace(TEMPORADA_FIXTURES, season)
+
+    def pitstops_json(self, season, race, limit, offset):
+        """
+        Method that returns a page of the Ergast pitstops of a race, honouring limit and offset.
+        """
+        datos = json.loads(json.dumps(self.pitstops))
+        mrdata = datos["MRData"]
+        carrera = mrdata["RaceTable"]["Races"][0]
+        paradas = carrera["PitStops"]
+        mrdata.update(limit=str(limit), offset=str(offset), total=str(len(paradas)))
+        mrdata["RaceTable"].update(season=season, round=race)
+        carrera.update(
+            season=season, round=race, PitStops=paradas[offset : offset + limit]
+        )
+        return json.dumps(datos)
+
+    def laps_json(self, season, race, limit, offset):
+        """
+        Method that returns a page of the Ergast lap timings of a race. As in Ergast, limit and offset
+        count timings, and the timings of the page are grouped by lap.
+        """
+        datos = json.loads(json.dumps(self.laps))
+        mrdata = datos["MRData"]
+        carrera = mrdata["RaceTable"]["Races"][0]
+        tiempos = [
+            (vuelta["number"], tiempo)
+            for vuelta in carrera["Laps"]
+            for tiempo in vuelta["Timings"]
+        ]
+        vueltas = {}
+        for numero, tiempo in tiempos[offset : offset + limit]:
+            vueltas.setdefault(numero, []).append(tiempo)
+        mrdata.update(limit=str(limit), offset=str(offset), total=str(len(tiempos)))
+        mrdata["RaceTable"].update(season=season, round=race)
+        carrera.update(
+            season=season,
+            round=race,
+            Laps=[
+                {"number": numero, "Timings": timings}
+                for numero, timings in vueltas.items()
+            ],
+        )
+        return json.dumps(datos)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Class that answers the requests to the stub server with the payloads of Fixtures.
+    """
+
+    fixtures = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        # Links such as /wiki/2023_São_Paulo_Grand_Prix arrive percent-encoded
+        path = unquote(url.path)
+        tipo = "text/html; charset=utf-8"
+        if busqueda := patron_temporada.match(path):
+            body = self.fixtures.season_page(busqueda.group(1))
+        elif busqueda := patron_carrera.match(path):
+            body = self.fixtures.race_page(busqueda.group(1))
+        elif busqueda := patron_pitstops.match(path):
+            tipo = "application/json"
+            body = self.fixtures.pitstops_json(
+                busqueda.group(1),
+                busqueda.group(2),
+                int(query.get("limit", ["30"])[0]),
+                int(query.get("offset", ["0"])[0]),
+            )
+        elif busqueda := patron_vueltas.match(path):
+            tipo = "application/json"
+            body = self.fixtures.laps_json(
+                busqueda.group(1),
+                busqueda.group(2),
+                int(query.get("limit", ["30"])[0]),
+                int(query.get("offset", ["0"])[0]),
+            )
+        elif busqueda := patron_pilotos.match(path):
+            tipo = "application/json"
+            body = self.fixtures.drivers_json(busqueda.group(1))
+        elif busqueda := patron_calendario.match(path):
+            tipo = "application/json"
+            body = self.fixtures.schedule_json(busqueda.group(1))
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        contenido = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(contenido)))
+        self.end_headers()
+        self.wfile.write(contenido)
+
+
+def start_server(port=0):
+    """
+    Function that starts the stub server in a background thread and returns it.
+    The base URLs are http://127.0.0.1:<port>/wiki and http://127.0.0.1:<port>/api/f1.
+    """
+    handler = type("Handler", (StubHandler,), {"fixtures": Fixtures()})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    server = start_server(int(sys.argv[1]) if len(sys.argv) > 1 else 8000)
+    print(f"Serving the fixtures on http://127.0.0.1:{server.server_port}")
+    threading.Event().wait()
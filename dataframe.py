@@ -13,107 +13,210 @@ Integrantes del grupo:
 Descripción:
 Obtención de un DataFrame producto del cruzado de los csv obtenidos a partir de formula1_spider.py y ergast_pitstops-data.py"""
 
+import numpy as np
 import pandas as pd
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from storage import dataset_path, get_storage
+from driver_registry import obtener_registro
+from metrics import obtener_metricas
+from surrogate_keys import obtener_diccionario
 
 
+# Columns on which the results and the pitstops are joined, all of them integers.
+MERGE_KEYS = ["Season", "RaceNumber", "DriverKey"]
+
+# Forms of the Time/Retired column: race time of the winner (1:33:56.736, or 3:27.071 in shortened races), gap to
+# the winner (+11.987, +1:02.345) and laps down (+1 Lap, +2 Laps). Anything else is the reason of the retirement.
+patron_time_retired = (
+    r"^\s*(?:(?:(?P<horas>\d+):)?(?P<minutos>\d{1,2}):(?P<segundos>\d{1,2}(?:\.\d+)?)"
+    r"|\+\s*(?:(?P<minutos_gap>\d+):)?(?P<segundos_gap>\d+(?:\.\d+)?)\s*s?"
+    r"|\+\s*(?P<vueltas>\d+)\s+laps?)\s*$"
+)
+patron_nota = r"\s*\[\w+\]"
+
 cache_path = "./cache/"
-spider_path = os.path.join(cache_path, "spider/")
-
-
-def get_all_csv(
-    df, path_to_csv_folder, sep=",", encoding="utf-8", clean=False
-) -> pd.DataFrame:
-    """
-    Function that creates a DataFrame from all the CSV files in a directory.
-    """
-    # To terate through the CSV files.
-    for csv in os.listdir(path_to_csv_folder):
-        csv_path = os.path.join(path_to_csv_folder, csv)
-
-        # To read the CSV file.
-        new_df = pd.read_csv(csv_path, sep=sep, encoding=encoding)
-
-        # To clean the CSV.
-        if clean:
-            try:
-                # Position of the first Source. ...
-                first_position_source = (
-                    new_df[(new_df["Pos"].str.contains("Source", na=False))]
-                    .iloc[0]
-                    .name
-                )
-            except:
-                first_position_source = len(new_df)
-            try:
-                # Position of the first Fastest ...
-                first_position_fastest = (
-                    new_df[(new_df["Pos"].str.contains("Fastest", na=False))]
-                    .iloc[0]
-                    .name
-                )
-            except:
-                first_position_fastest = len(new_df)
-
-            # We take the dataframe up to the minimum value to remove the part that does not belong to the table.
-
-            new_df = new_df.iloc[: min(first_position_fastest, first_position_source)]
-
-        # To concatenate the new data to the existing dataframe.
-        df = pd.concat([df, new_df])
-    return df
+spider_store_path = os.path.join(cache_path, "spider_store")
+procesado_path = os.path.join(cache_path, "procesado")
 
 
-def get_df() -> pd.DataFrame:
+def list_csv(path_to_folder) -> list:
     """
-    Function that retrieves the dataframe containing all the information extracted from Wikipedia.
+    Function that lists the CSV files of a directory and of its subdirectories (one per season).
     """
-    df = pd.DataFrame()
+    csv_files = []
+    for root, dirs, files in os.walk(path_to_folder):
+        dirs.sort()
+        csv_files.extend(
+            os.path.join(root, csv) for csv in sorted(files) if csv.endswith(".csv")
+        )
+    return csv_files
 
-    # To iterate through the spider directories.
-    for dir in os.listdir(spider_path):
-        current_dir = os.path.join(spider_path, dir)
-        # We retrieve all the CSV files within the directory.
-        df = get_all_csv(df, current_dir, clean=True)
 
-    # To remove NA values.
-    df = df.dropna(subset="Constructor")
-    df["DriverNumber"] = df["DriverNumber"].astype(int)
+def read_csv(csv_path, sep=",", encoding="utf-8") -> pd.DataFrame:
+    """
+    Function that reads a CSV file.
+    """
+    return pd.read_csv(csv_path, sep=sep, encoding=encoding)
+
+
+def read_csv_files(csv_files, sep=",", encoding="utf-8", max_workers=8) -> pd.DataFrame:
+    """
+    Function that reads a list of CSV files in parallel and concatenates them once.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        dfs = list(
+            executor.map(lambda csv_path: read_csv(csv_path, sep, encoding), csv_files)
+        )
+    if not dfs:
+        return pd.DataFrame()
+    return pd.concat(dfs, ignore_index=True)
+
 
-    # To change the names.
-    df = df.replace(
+def extract_time_retired(textos):
+    """
+    Function that removes the footnotes of some Time/Retired texts and applies patron_time_retired to them.
+    Returns the cleaned texts and a DataFrame with the numeric value of every group (NaN if it did not match).
+    The expression runs in pyarrow (RE2, without Python loops) when it is installed, otherwise in pandas.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+    except ImportError:
+        textos = pd.Series(textos, dtype="string")
+        textos = textos.str.replace(patron_nota, "", regex=True).str.strip()
+        partes = textos.str.extract(patron_time_retired, flags=re.IGNORECASE)
+        return textos, pd.DataFrame({col: pd.to_numeric(partes[col]) for col in partes})
+
+    textos = pa.array(textos, type=pa.string(), from_pandas=True)
+    textos = pc.utf8_trim_whitespace(
+        pc.replace_substring_regex(textos, patron_nota, "")
+    )
+    partes = pc.extract_regex(textos, "(?i)" + patron_time_retired)
+    numeros = {}
+    for campo in partes.type:
+        # Groups of the alternatives that did not match are empty strings
+        valores = pc.struct_field(partes, campo.name)
+        valores = pc.if_else(pc.equal(valores, ""), None, valores)
+        numeros[campo.name] = pc.cast(valores, pa.float64()).to_numpy(
+            zero_copy_only=False
+        )
+    return textos.to_pandas(), pd.DataFrame(numeros)
+
+
+def parse_time_retired(values) -> pd.DataFrame:
+    """
+    Function that converts the Time/Retired column to the gap to the winner in seconds (GapSeconds, 0 for the winner),
+    the laps behind the winner (LapsDown) and the reason of the retirement (RetirementReason, a categorical).
+    Only the distinct texts are parsed and every row takes the result of its text by position.
+    """
+    codigos, unicos = pd.factorize(pd.Series(values, dtype=object))
+    textos, numeros = extract_time_retired(unicos)
+
+    # A missing result is appended to the distinct texts, so rows without text (code -1) take it
+    numeros = pd.concat(
+        [numeros, pd.DataFrame(index=[len(numeros)])], ignore_index=True
+    )
+    ganador = numeros["minutos"].notna().to_numpy()
+    gap = (numeros["minutos_gap"].fillna(0) * 60 + numeros["segundos_gap"]).to_numpy()
+    vueltas = numeros["vueltas"].to_numpy()
+    clasificado = ganador | ~np.isnan(gap) | ~np.isnan(vueltas)
+    motivos = pd.Categorical(pd.Series(textos, dtype=object).where(~clasificado[:-1]))
+
+    laps_down = np.where(np.isnan(vueltas), 0, vueltas).astype(np.int16)
+    return pd.DataFrame(
         {
-            "Carlos Sainz Jr. 2": "Carlos Sainz",
-            "Carlos Sainz Jr.": "Carlos Sainz",
-            "Nikita Mazepin [a]": "Nikita Mazepin",
-            "Nikita Mazepin [b]": "Nikita Mazepin",
-            "Nikita Mazepin [c]": "Nikita Mazepin",
-            "Nikita Mazepin [e]": "Nikita Mazepin",
-            "Nikita Mazepin [d]": "Nikita Mazepin",
+            "GapSeconds": np.where(ganador, 0.0, gap)[codigos],
+            "LapsDown": pd.arrays.IntegerArray(
+                laps_down[codigos], ~clasificado[codigos]
+            ),
+            "RetirementReason": pd.Categorical.from_codes(
+                np.append(motivos.codes, -1)[codigos], motivos.categories
+            ),
         }
     )
 
-    # To remove numbers that appear to the right of the actual value (separated by a space).
-    cols = ["Pos", "DriverNumber", "Grid"]
-    df[cols] = df[cols].apply(
-        lambda x: x.apply(lambda y: y.split(" ")[0] if isinstance(y, str) else y)
+
+def filter_units(df, units) -> pd.DataFrame:
+    """
+    Function that keeps only the rows of the given (Season, RaceNumber) races.
+    """
+    races = df.set_index(["Season", "RaceNumber"]).index
+    return df[races.isin(list(units))]
+
+
+def get_df(units=None, store_format="csv") -> pd.DataFrame:
+    """
+    Function that retrieves the dataframe containing all the information extracted from Wikipedia.
+    If a list of (Season, RaceNumber) races is given, only those races are read.
+    """
+    # We retrieve the rows cleaned by the spider pipeline from the results store.
+    seasons = None if units is None else sorted({season for season, _ in units})
+    df = get_storage(store_format).read_dataset(
+        dataset_path(spider_store_path, store_format), seasons=seasons
     )
+    if units is not None and len(df):
+        df = filter_units(df, units)
+
+    # To remove NA values.
+    df = df.dropna(subset="Constructor")
+    df["DriverNumber"] = df["DriverNumber"].astype(int)
+    df["Season"] = df["Season"].astype(np.int16)
+    df["RaceNumber"] = df["RaceNumber"].astype(np.int16)
+
+    # To change the names to the canonical ones of the driver registry, looking up every distinct name once.
+    registro = obtener_registro()
+    nombres = df["Driver"].astype(str)
+    canonicos = {nombre: registro.get_by_name(nombre) for nombre in nombres.unique()}
+
+    # Drivers and constructors are identified by integer keys; the names are categoricals over the keys
+    pilotos = obtener_diccionario("drivers")
+    constructores = obtener_diccionario("constructors")
+    df["DriverKey"] = pilotos.encode(nombres.map(canonicos))
+    df["ConstructorKey"] = constructores.encode(df["Constructor"])
+    df["Driver"] = pilotos.decode(df["DriverKey"])
+    df["Constructor"] = constructores.decode(df["ConstructorKey"])
+
+    # Numeric gaps, laps down and retirement reasons from the Time/Retired text
+    df[["GapSeconds", "LapsDown", "RetirementReason"]] = parse_time_retired(
+        df["Time/Retired"]
+    ).set_index(df.index)
     return df
 
 
-def get_procesado() -> pd.DataFrame:
+def procesado_files(units) -> list:
     """
-    Function that retrieves the dataframe of Ergast F1 API
+    Function that returns the processed Ergast files of the given (Season, RaceNumber) races that exist.
     """
-    df = pd.DataFrame()
+    paths = [
+        os.path.join(procesado_path, str(season), f"pitstops_{season}_{race}.csv")
+        for season, race in sorted(units)
+    ]
+    return [path for path in paths if os.path.exists(path)]
 
-    procesado_path = os.path.join(cache_path, "procesado")
 
-    # We iterate through the processed directory.
-    for dir in os.listdir(procesado_path):
-        dir_path = os.path.join(procesado_path, dir)
-        df = get_all_csv(df, dir_path)
+def get_procesado(units=None) -> pd.DataFrame:
+    """
+    Function that retrieves the dataframe of Ergast F1 API
+    If a list of (Season, RaceNumber) races is given, only those races are read.
+    """
+    # We retrieve all the CSV files within the processed directory.
+    if units is None:
+        csv_files = list_csv(procesado_path)
+    else:
+        csv_files = procesado_files(units)
+
+    df = read_csv_files(csv_files)
+    if not len(df):
+        df = pd.DataFrame({"Driver": [], "Season": [], "RaceNumber": []})
+    df["Season"] = df["Season"].astype(np.int16)
+    df["RaceNumber"] = df["RaceNumber"].astype(np.int16)
 
+    # The names of the processed files are already the canonical ones of the driver registry
+    pilotos = obtener_diccionario("drivers")
+    df["DriverKey"] = pilotos.encode(df["Driver"])
+    df["Driver"] = pilotos.decode(df["DriverKey"])
     return df
 
 
@@ -121,23 +224,77 @@ def merge_dfs(df1, df_procesado) -> pd.DataFrame:
     """
     Function that merges the two F1 dataframes
     """
-    # We merge the dataframes.
-    return pd.merge(
-        df1, df_procesado, on=["Driver", "Season", "RaceNumber"], how="outer"
+    # We merge the dataframes on integer keys; the driver names are recovered from the keys afterwards.
+    merged_df = pd.merge(
+        df1.drop(columns="Driver"),
+        df_procesado.drop(columns="Driver"),
+        on=MERGE_KEYS,
+        how="outer",
     )
+    merged_df.insert(
+        list(df1.columns).index("Driver"),
+        "Driver",
+        obtener_diccionario("drivers").decode(merged_df["DriverKey"]),
+    )
+    return merged_df
 
 
-def create_df() -> pd.DataFrame:
+def create_df(format="csv", store_format="csv") -> pd.DataFrame:
     """
     Create a single dataframe from the information extracted from Wikipedia and Ergast F1 API
     """
+    metricas = obtener_metricas()
+
     # The two dataframes are created.
-    df1 = get_df()
-    df_procesado = get_procesado()
+    with metricas.stage("merge.read_results"):
+        df1 = get_df(store_format=store_format)
+    with metricas.stage("merge.read_pitstops"):
+        df_procesado = get_procesado()
+
+    with metricas.stage("merge.merge"):
+        merged_df = merge_dfs(df1, df_procesado)
+    metricas.count("merge.rows", len(merged_df))
+
+    # Save the merged DataFrame (dataframe.csv, dataframe.parquet or dataframe.arrow)
+    with metricas.stage("merge.write"):
+        get_storage(format).write(merged_df, dataset_path("dataframe", format))
+
+    return merged_df
+
+
+def load_df(columns=None, seasons=None, format="csv") -> pd.DataFrame:
+    """
+    Function that reads the merged dataframe saved by create_df, optionally only some columns and seasons.
+    """
+    return get_storage(format).read(dataset_path("dataframe", format), columns, seasons)
+
+
+def update_df(units, format="csv", store_format="csv"):
+    """
+    Function that patches the merged dataframe replacing only the rows of the given (Season, RaceNumber) races.
+    """
+    keys = ["Season", "RaceNumber"]
+
+    # The rows of the races that changed are removed from the existing dataframe.
+    if os.path.exists(dataset_path("dataframe", format)):
+        merged_df = load_df(format=format)
+        stale = merged_df.set_index(keys).index.isin(list(units))
+        merged_df = merged_df[~stale]
+    else:
+        merged_df = pd.DataFrame()
+
+    metricas = obtener_metricas()
 
-    merged_df = merge_dfs(df1, df_procesado)
+    # Only the races that changed are read and merged again.
+    if units:
+        with metricas.stage("merge.update", races=len(units)):
+            df1 = get_df(units, store_format)
+            df_procesado = get_procesado(units)
+            merged_df = pd.concat([merged_df, merge_dfs(df1, df_procesado)])
+    metricas.count("merge.rows", len(merged_df))
 
-    # Save the merged DataFrame to a CSV file
-    merged_df.to_csv("dataframe.csv", index=False)
+    merged_df = merged_df.sort_values(keys, kind="stable")
+    with metricas.stage("merge.write"):
+        get_storage(format).write(merged_df, dataset_path("dataframe", format))
 
     return merged_df
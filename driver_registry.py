@@ -0,0 +1,185 @@
+"""
+driver_registry.py
+
+Adquisición de datos - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Integrantes del grupo:
+    - Lydia Ruiz
+    - David Tarrasa
+    - Jorge Vančo
+    - Alberto Velasco
+
+Descripción:
+Registro persistente de pilotos (identificador de Ergast, número, nombre y alias) compartido por todos los módulos"""
+
+import json
+import os
+import re
+import threading
+
+
+# Names used by Wikipedia that differ from the canonical name of the driver, saved with the record of the driver.
+ALIAS_PILOTOS = {
+    "Carlos Sainz": ["Carlos Sainz Jr.", "Carlos Sainz Jr. 2"],
+    "Nikita Mazepin": [
+        "Nikita Mazepin [a]",
+        "Nikita Mazepin [b]",
+        "Nikita Mazepin [c]",
+        "Nikita Mazepin [d]",
+        "Nikita Mazepin [e]",
+    ],
+}
+
+# Drivers whose family name goes first.
+NOMBRE_INVERTIDO = {"zhou"}
+
+patron_nota = re.compile(r"\s*\[\w\]$")
+
+
+def canonical_name(driver_id, given_name, family_name):
+    """
+    Function that builds the name of a driver as it appears on Wikipedia.
+    """
+    if driver_id in NOMBRE_INVERTIDO:
+        given_name, family_name = family_name, given_name
+    return given_name + " " + family_name
+
+
+class DriverRegistry:
+    """
+    Class that keeps the drivers known by the project in an append-only JSON lines file.
+    Every record is indexed by driverId, permanent number and name (including aliases).
+    """
+
+    def __init__(self, path="cache/drivers.jsonl"):
+        self.path = path
+        self.drivers = {}
+        self.seasons = {}
+        self.by_number = {}
+        self.by_name = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as fich:
+                for linea in fich:
+                    if linea.strip():
+                        self.apply(json.loads(linea))
+        # Records saved before their aliases were known are written again with them
+        for registro in list(self.drivers.values()):
+            self.add(registro["driverId"], registro["number"], registro["name"])
+
+    def apply(self, registro):
+        """
+        Method that adds a record of the file (a driver or the drivers of a season) to the indexes.
+        """
+        if registro["type"] == "season":
+            self.seasons[registro["season"]] = registro["drivers"]
+            return
+        driver_id = registro["driverId"]
+        anterior = self.drivers.get(driver_id, {"aliases": []})
+        registro["aliases"] = sorted(
+            set(anterior["aliases"]) | set(registro["aliases"])
+        )
+        self.drivers[driver_id] = registro
+        if registro["number"] is not None:
+            self.by_number[registro["number"]] = driver_id
+        for nombre in [registro["name"]] + registro["aliases"]:
+            self.by_name[nombre] = registro["name"]
+
+    def append(self, registro):
+        """
+        Method that writes a record at the end of the file and adds it to the indexes.
+        """
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as fich:
+                fich.write(json.dumps(registro, ensure_ascii=False) + "\n")
+            self.apply(registro)
+
+    def add(self, driver_id, number, name, aliases=()):
+        """
+        Method that registers a driver with its aliases (and the known ones of ALIAS_PILOTOS),
+        only writing to the file if something changed.
+        """
+        aliases = set(aliases) | set(ALIAS_PILOTOS.get(name, []))
+        registro = {
+            "type": "driver",
+            "driverId": driver_id,
+            "number": number,
+            "name": name,
+            "aliases": sorted(aliases),
+        }
+        actual = self.drivers.get(driver_id)
+        if (
+            actual is not None
+            and actual["number"] == number
+            and actual["name"] == name
+            and set(aliases) <= set(actual["aliases"])
+        ):
+            return
+        self.append(registro)
+
+    def add_season(self, season, driver_ids):
+        """
+        Method that registers the drivers that took part in a season, only writing to the file if they changed.
+        """
+        if self.seasons.get(season) == list(driver_ids):
+            return
+        self.append({"type": "season", "season": season, "drivers": list(driver_ids)})
+
+    def has_season(self, season):
+        """
+        Method that tells whether the drivers of a season are already registered.
+        """
+        return season in self.seasons
+
+    def get(self, driver_id):
+        """
+        Method that returns the record of a driverId, or None.
+        """
+        return self.drivers.get(driver_id)
+
+    def get_by_number(self, number):
+        """
+        Method that returns the record of the driver who used a permanent number most recently, or None.
+        """
+        return self.drivers.get(self.by_number.get(int(number)))
+
+    def get_by_name(self, name):
+        """
+        Method that returns the canonical name of a displayed name (aliases and footnotes are removed).
+        """
+        if name in self.by_name:
+            return self.by_name[name]
+        return self.by_name.get(re.sub(patron_nota, "", name), name)
+
+    def mapping(self, seasons):
+        """
+        Method that returns {driverId: {"number", "name"}} for the drivers of some seasons.
+        Drivers without a permanent number have the number "-1".
+        """
+        pilotos = {}
+        for season in seasons:
+            for driver_id in self.seasons.get(season, []):
+                registro = self.drivers[driver_id]
+                numero = registro["number"]
+                pilotos[driver_id] = {
+                    "number": str(numero) if numero is not None else "-1",
+                    "name": registro["name"],
+                }
+        return pilotos
+
+
+registro_pilotos = None
+lock_registro = threading.Lock()
+
+
+def obtener_registro():
+    """
+    Function that returns the driver registry shared by every module of the project.
+    """
+    global registro_pilotos
+    with lock_registro:
+        if registro_pilotos is None:
+            registro_pilotos = DriverRegistry()
+    return registro_pilotos
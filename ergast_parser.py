@@ -0,0 +1,179 @@
+"""
+ergast_parser.py
+
+Adquisición de datos - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Integrantes del grupo:
+    - Lydia Ruiz
+    - David Tarrasa
+    - Jorge Vančo
+    - Alberto Velasco
+
+Descripción:
+Lectura incremental de las respuestas XML y JSON de la API de Ergast, que se convierten en registros tipados de pit-stops y pilotos"""
+
+import json
+from collections import namedtuple
+from xml.etree.ElementTree import XMLPullParser
+
+
+PitStop = namedtuple(
+    "PitStop", ["driverId", "stop", "lap", "time", "duration", "season", "round"]
+)
+Driver = namedtuple(
+    "Driver", ["driverId", "permanentNumber", "code", "givenName", "familyName"]
+)
+LapTime = namedtuple(
+    "LapTime", ["driverId", "lap", "position", "time", "season", "round"]
+)
+Race = namedtuple("Race", ["season", "round", "raceName", "date", "time"])
+
+# Size of the chunks fed to the XML parser.
+TAMANO_BLOQUE = 64 * 1024
+
+
+def iter_events(contenido, meta=None, events=("start", "end")):
+    """
+    Function that feeds an XML payload to a pull parser in chunks and yields (event, tag, element) without namespaces.
+    The attributes of the MRData element (limit, offset, total...) are stored in meta.
+    """
+    if isinstance(contenido, str):
+        contenido = contenido.encode("utf-8")
+    vista = memoryview(contenido)
+    parser = XMLPullParser(events=events)
+
+    for inicio in range(0, len(vista), TAMANO_BLOQUE):
+        parser.feed(vista[inicio : inicio + TAMANO_BLOQUE])
+        for evento, elemento in parser.read_events():
+            # {http://ergast.com/mrd/1.5}PitStop -> PitStop
+            tag = elemento.tag.rpartition("}")[2]
+            if evento == "start" and tag == "MRData" and meta is not None:
+                meta.update(elemento.attrib)
+            yield evento, tag, elemento
+    parser.close()
+
+
+def parse_pitstops_xml(contenido, meta=None):
+    """
+    Function that yields the pitstops of an Ergast XML response.
+    """
+    season = race = None
+    # PitStop elements have no children, so their start event already has every attribute
+    for evento, tag, elemento in iter_events(contenido, meta, ("start",)):
+        if tag == "Race":
+            season = int(elemento.get("season"))
+            race = int(elemento.get("round"))
+        elif tag == "PitStop":
+            atributos = elemento.attrib
+            yield PitStop(
+                atributos["driverId"],
+                int(atributos["stop"]),
+                int(atributos["lap"]),
+                atributos["time"],
+                atributos["duration"],
+                season,
+                race,
+            )
+
+
+def parse_drivers_xml(contenido, meta=None):
+    """
+    Function that yields the drivers of an Ergast XML response, whatever the order of their fields.
+    """
+    campos = {}
+    for evento, tag, elemento in iter_events(contenido, meta):
+        if evento != "end":
+            continue
+        if tag in ("PermanentNumber", "GivenName", "FamilyName"):
+            campos[tag] = elemento.text
+        elif tag == "Driver":
+            numero = campos.get("PermanentNumber")
+            yield Driver(
+                elemento.get("driverId"),
+                int(numero) if numero else None,
+                elemento.get("code"),
+                campos.get("GivenName"),
+                campos.get("FamilyName"),
+            )
+            campos = {}
+            # The processed elements are released so that memory does not grow with the payload
+            elemento.clear()
+
+
+def parse_pitstops_json(contenido, meta=None):
+    """
+    Function that yields the pitstops of an Ergast JSON response (.json endpoints).
+    """
+    datos = json.loads(contenido)["MRData"]
+    if meta is not None:
+        meta.update({k: v for k, v in datos.items() if isinstance(v, str)})
+    for carrera in datos["RaceTable"]["Races"]:
+        season, race = int(carrera["season"]), int(carrera["round"])
+        for parada in carrera.get("PitStops", []):
+            yield PitStop(
+                parada["driverId"],
+                int(parada["stop"]),
+                int(parada["lap"]),
+                parada["time"],
+                parada["duration"],
+                season,
+                race,
+            )
+
+
+def parse_laps_json(contenido, meta=None):
+    """
+    Function that yields the lap timings of an Ergast JSON response (/{season}/{round}/laps.json).
+    """
+    datos = json.loads(contenido)["MRData"]
+    if meta is not None:
+        meta.update({k: v for k, v in datos.items() if isinstance(v, str)})
+    for carrera in datos["RaceTable"]["Races"]:
+        season, race = int(carrera["season"]), int(carrera["round"])
+        for vuelta in carrera.get("Laps", []):
+            lap = int(vuelta["number"])
+            for tiempo in vuelta["Timings"]:
+                yield LapTime(
+                    tiempo["driverId"],
+                    lap,
+                    int(tiempo["position"]),
+                    tiempo["time"],
+                    season,
+                    race,
+                )
+
+
+def parse_drivers_json(contenido, meta=None):
+    """
+    Function that yields the drivers of an Ergast JSON response (.json endpoints).
+    """
+    datos = json.loads(contenido)["MRData"]
+    if meta is not None:
+        meta.update({k: v for k, v in datos.items() if isinstance(v, str)})
+    for piloto in datos["DriverTable"]["Drivers"]:
+        numero = piloto.get("permanentNumber")
+        yield Driver(
+            piloto["driverId"],
+            int(numero) if numero else None,
+            piloto.get("code"),
+            piloto.get("givenName"),
+            piloto.get("familyName"),
+        )
+
+
+def parse_schedule_json(contenido, meta=None):
+    """
+    Function that yields the races of an Ergast season schedule JSON response (/{season}.json).
+    """
+    datos = json.loads(contenido)["MRData"]
+    if meta is not None:
+        meta.update({k: v for k, v in datos.items() if isinstance(v, str)})
+    for carrera in datos["RaceTable"]["Races"]:
+        yield Race(
+            int(carrera["season"]),
+            int(carrera["round"]),
+            carrera.get("raceName"),
+            carrera["date"],
+            carrera.get("time"),
+        )
@@ -13,76 +13,468 @@ Integrantes del grupo:
 Descripción:
 Obtención de un DataFrame producto del cruzado de los csv obtenidos a partir de formula1_spider.py y ergast_pitstops-data.py"""
 
-import shutil
 import requests as req
+import numpy as np
 import pandas as pd
-import re
-import os
+import datetime
 import json
+import os
+import multiprocessing
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http_cache import obtener_cache
+from ergast_parser import (
+    parse_drivers_json,
+    parse_laps_json,
+    parse_pitstops_json,
+    parse_schedule_json,
+)
+from driver_registry import canonical_name, obtener_registro
+from metrics import obtener_metricas
+from lap_store import LapStore, lap_times_to_ms, load_lap_store, season_path
 
 
-patron_pitstop = re.compile(
-    r'<PitStop driverId="(\w+)" stop="(\d+)" lap="(\d+)" time="(\d+:\d+:\d+)" duration="([\d:|]+\d+\.\d+)"\/>'
-)
+# Base URL of the Ergast API. It can be pointed at a local stub server for testing.
+ERGAST_URL = "https://ergast.com/api/f1"
+
+# Maximum page size accepted by the Ergast API.
+LIMITE_PAGINA = 1000
+
+# File with the schedule of every season downloaded so far.
+calendarios_path = "cache/calendarios.json"
+
+# Time after the start of a race from which its pitstops are requested.
+DURACION_CARRERA = datetime.timedelta(hours=3)
+
+# Seconds to connect and to receive each response.
+TIMEOUT = (5, 30)
 
+# Attempts of each request and limits (seconds) of the exponential backoff between them.
+INTENTOS = 5
+ESPERA_BASE = 0.5
+ESPERA_MAXIMA = 30
 
-def conseguir_pitstops_año_carrera(anno, num_carrera, update=False, crear_csv=False):
+# Consecutive failures that open the circuit of a host, and seconds it stays open.
+FALLOS_CIRCUITO = 5
+ESPERA_CIRCUITO = 60
+
+# Status codes worth retrying: rate limit and server errors.
+CODIGOS_REINTENTO = {429, 500, 502, 503, 504}
+
+
+def crear_sesion(max_conexiones=8):
     """
-    Function that retrieves pitstop information for a specific Formula 1 race and year
+    Function that creates an HTTP session whose connection pool can be shared between threads.
     """
-    global patron_pitstop
-    # Ensure the existence of necessary directories
-    os.makedirs("cache", exist_ok=True)
-    os.makedirs(f"cache/{anno}", exist_ok=True)
+    sesion = req.Session()
+    adaptador = req.adapters.HTTPAdapter(
+        pool_connections=max_conexiones, pool_maxsize=max_conexiones
+    )
+    sesion.mount("http://", adaptador)
+    sesion.mount("https://", adaptador)
+    return sesion
+
 
-    # Define the path for the cache file
+class LimitadorPeticiones:
+    """
+    Class that spaces out the requests sent from any thread so that the rate limit is never exceeded.
+    """
+
+    def __init__(self, peticiones_por_segundo=None):
+        self.intervalo = 1 / peticiones_por_segundo if peticiones_por_segundo else 0
+        self.siguiente = 0.0
+        self.lock = threading.Lock()
+
+    def esperar(self):
+        """
+        Method that blocks until the calling thread is allowed to send its request.
+        """
+        if not self.intervalo:
+            return
+        with self.lock:
+            ahora = time.monotonic()
+            turno = max(ahora, self.siguiente)
+            self.siguiente = turno + self.intervalo
+        time.sleep(max(0.0, turno - ahora))
+
+
+class InterruptorCircuito:
+    """
+    Class that implements the circuit breaker of a host. After FALLOS_CIRCUITO consecutive failures
+    the requests to the host fail at once for ESPERA_CIRCUITO seconds; then a single request is let
+    through and, if it works, the circuit is closed again.
+    """
+
+    def __init__(self, host, fallos_maximos=FALLOS_CIRCUITO, espera=ESPERA_CIRCUITO):
+        self.host = host
+        self.fallos_maximos = fallos_maximos
+        self.espera = espera
+        self.fallos = 0
+        self.abierto_hasta = None
+        self.prueba_en_curso = False
+        self.lock = threading.Lock()
+
+    def permitir(self):
+        """
+        Method that tells whether a request can be sent to the host (the circuit is not open).
+        """
+        with self.lock:
+            if self.abierto_hasta is None:
+                return True
+            if time.monotonic() >= self.abierto_hasta and not self.prueba_en_curso:
+                self.prueba_en_curso = True
+                return True
+            return False
+
+    def exito(self):
+        """
+        Method that records a successful request, closing the circuit.
+        """
+        with self.lock:
+            self.fallos = 0
+            self.abierto_hasta = None
+            self.prueba_en_curso = False
+
+    def fallo(self):
+        """
+        Method that records a failed request, opening the circuit if there are too many in a row.
+        """
+        with self.lock:
+            self.fallos += 1
+            if self.prueba_en_curso or self.fallos >= self.fallos_maximos:
+                if self.abierto_hasta is None or self.prueba_en_curso:
+                    obtener_metricas().count("ergast.circuit_opened")
+                self.abierto_hasta = time.monotonic() + self.espera
+                self.prueba_en_curso = False
+
+
+interruptores = {}
+lock_interruptores = threading.Lock()
+
+
+def obtener_interruptor(url):
+    """
+    Function that returns the circuit breaker shared by every request to the host of a URL.
+    """
+    host = urlsplit(url).netloc
+    with lock_interruptores:
+        if host not in interruptores:
+            interruptores[host] = InterruptorCircuito(host)
+        return interruptores[host]
+
+
+def espera_reintento(intento, response=None):
+    """
+    Function that returns the seconds to wait before a new attempt: the Retry-After of the server
+    if there is one, or an exponential backoff with full jitter.
+    """
+    if response is not None and response.headers.get("Retry-After", "").isdigit():
+        return min(float(response.headers["Retry-After"]), ESPERA_MAXIMA)
+    return random.uniform(0, min(ESPERA_MAXIMA, ESPERA_BASE * 2**intento))
+
+
+def validar_respuesta(url, response):
+    """
+    Function that raises an exception if a response is an error, or an error page instead of the JSON requested.
+    """
+    response.raise_for_status()
+    es_json = response.content.lstrip().startswith(b"{")
+    if urlsplit(url).path.endswith(".json") and not es_json:
+        raise req.exceptions.InvalidJSONError(
+            f"not a JSON response: {url}", response=response
+        )
+
+
+def descargar_bytes(url, sesion=None, limitador=None, cache=None):
+    """
+    Function that downloads a URL (respecting the rate limit) and returns its raw content.
+    Responses are served from the shared HTTP cache and revalidated when they expire.
+    Failed requests are retried with backoff; if they keep failing, the expired cached response is
+    returned if there is one, and otherwise the last error is raised. Only valid responses are cached,
+    so the pages already downloaded are kept when a download is interrupted and resumed later.
+    """
+    cache = cache or obtener_cache()
+    metricas = obtener_metricas()
+    guardada = cache.get(url)
+    if guardada is not None and guardada.fresh:
+        metricas.count("ergast.cache_hits")
+        return guardada.body
+
+    interruptor = obtener_interruptor(url)
+    cabeceras = guardada.conditional_headers() if guardada is not None else {}
+    for intento in range(INTENTOS):
+        response = None
+        if not interruptor.permitir():
+            ultimo_error = req.ConnectionError(f"circuit open for {interruptor.host}")
+            break
+        try:
+            if limitador is not None:
+                limitador.esperar()
+            response = (sesion or req).get(url, headers=cabeceras, timeout=TIMEOUT)
+            metricas.count("ergast.http_requests")
+            metricas.count("ergast.http_bytes", len(response.content))
+            if response.status_code != 304 or guardada is None:
+                validar_respuesta(url, response)
+        except req.RequestException as error:
+            # Client errors (404...) will not change by retrying, but they do not open the circuit
+            codigo = response.status_code if response is not None else None
+            if codigo in range(400, 500) and codigo not in CODIGOS_REINTENTO:
+                interruptor.exito()
+                raise
+            interruptor.fallo()
+            metricas.count("ergast.http_errors")
+            ultimo_error = error
+            if intento < INTENTOS - 1:
+                metricas.count("ergast.retries")
+                time.sleep(espera_reintento(intento, response))
+            continue
+        interruptor.exito()
+
+        if response.status_code == 304 and guardada is not None:
+            metricas.count("ergast.cache_revalidated")
+            cache.refresh(url)
+            return guardada.body
+        cache.put(
+            url,
+            response.content,
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+        )
+        return response.content
+
+    # The server could not be reached: an expired response is better than none
+    if guardada is not None:
+        metricas.count("ergast.stale_responses")
+        return guardada.body
+    raise ultimo_error
+
+
+# Columns of the pitstop batches and of the raw pitstop files.
+COLUMNAS_PITSTOPS = [
+    "piloto",
+    "parada",
+    "vuelta",
+    "hora",
+    "duracion",
+    "anno",
+    "carrera",
+]
+
+
+def lote_pitstops(pitstops):
+    """
+    Function that converts a list of PitStop records to a columnar batch {column: NumPy array}.
+    Durations are kept as text (1:02.345 is possible) and converted when the batch is aggregated.
+    """
+    columnas = list(zip(*pitstops)) if pitstops else [()] * 7
+    return {
+        "piloto": np.array(columnas[0], dtype=object),
+        "parada": np.array(columnas[1], dtype=np.int16),
+        "vuelta": np.array(columnas[2], dtype=np.int16),
+        "hora": np.array(columnas[3], dtype=object),
+        "duracion": np.array(columnas[4], dtype=object),
+        "anno": np.array(columnas[5], dtype=np.int16),
+        "carrera": np.array(columnas[6], dtype=np.int16),
+    }
+
+
+def unir_lotes(lotes) -> pd.DataFrame:
+    """
+    Function that joins several pitstop batches into a single table, concatenating each column once.
+    """
+    lotes = list(lotes) or [lote_pitstops([])]
+    return pd.DataFrame(
+        {
+            columna: np.concatenate([lote[columna] for lote in lotes])
+            for columna in COLUMNAS_PITSTOPS
+        }
+    )
+
+
+def guardar_pitstops_csv(lote, path, cabecera=True, modo="w"):
+    """
+    Function that writes a pitstop batch to a raw CSV file (piloto;parada;vuelta;hora;duracion;anno;carrera).
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    pd.DataFrame(lote).to_csv(path, sep=";", index=False, header=cabecera, mode=modo)
+
+
+def leer_pitstops_csv(path):
+    """
+    Function that reads a raw CSV file of pitstops as a batch.
+    """
+    df = pd.read_csv(path, sep=";", dtype={"hora": str, "duracion": str})
+    return lote_pitstops(list(df[COLUMNAS_PITSTOPS].itertuples(index=False)))
+
+
+def conseguir_pitstops_año_carrera(
+    anno, num_carrera, update=False, crear_csv=False, sesion=None, limitador=None
+):
+    """
+    Function that retrieves pitstop information for a specific Formula 1 race and year
+    Returns a columnar batch (see lote_pitstops). With crear_csv, the raw pitstops are also
+    saved to cache/{anno}/{anno}_{num_carrera}.csv, which is read instead of the API afterwards.
+    """
+    # Define the path for the raw file
     path = f"cache/{anno}/{anno}_{num_carrera}.csv"
 
-    # Check if the cache file doesn't exist or if update is requested
-    if not os.path.exists(path) or update:
-        pitstops_carrera = []
-        i = 1
-        seguir = True
+    # Read pitstop data from the existing raw file if there is one and no update is requested
+    if os.path.exists(path) and not update:
+        return leer_pitstops_csv(path)
 
-        # Loop to retrieve pitstop data from an API
-        while seguir:
-            response = req.get(
-                f"https://ergast.com/api/f1/{anno}/{num_carrera}/pitstops/{i}"
+    # Time of the download of each race
+    with obtener_metricas().stage("ergast.race", season=anno, race=num_carrera):
+        pitstops_carrera = []
+        offset = 0
+        total = None
+
+        # The MRData element reports the total number of pit stops, so the whole race
+        # is usually retrieved with a single request of the maximum page size
+        while total is None or offset < total:
+            contenido = descargar_bytes(
+                f"{ERGAST_URL}/{anno}/{num_carrera}/pitstops.json"
+                f"?limit={LIMITE_PAGINA}&offset={offset}",
+                sesion,
+                limitador,
             )
-            contenido = response.content.decode("utf-8")
-            contenido = contenido.split("\n")
-
-            nuevas_pitstops = []
 
             # Parse pitstop data from the API response
-            for linea in contenido:
-                bus = re.search(patron_pitstop, linea)
-                if bus != None:
-                    piloto, parada, vuelta, hora, duracion = bus.groups()
-                    nuevas_pitstops.append(
-                        f"{piloto};{parada};{vuelta};{hora};{duracion};{anno};{num_carrera}\n"
-                    )
+            meta = {}
+            pitstops_carrera.extend(parse_pitstops_json(contenido, meta))
+            total = int(meta.get("total", 0))
+
+            offset += LIMITE_PAGINA
+
+        lote = lote_pitstops(pitstops_carrera)
+
+    # Write pitstop data to a CSV file if there is data and creation of CSV is requested
+    if len(pitstops_carrera) > 0 and crear_csv:
+        guardar_pitstops_csv(lote, path)
 
-            pitstops_carrera.extend(nuevas_pitstops)
-            seguir = True if len(nuevas_pitstops) > 0 else False
-            i += 1
+    return lote
 
-        # Write pitstop data to a CSV file if there is data and creation of CSV is requested
-        if len(pitstops_carrera) > 0 and crear_csv:
-            with open(path, "w") as f:
-                f.write("piloto;parada;vuelta;hora;duracion;anno;carrera\n")
-                f.writelines(pitstops_carrera)
 
-    else:
-        # Read pitstop data from the existing cache file
-        with open(path, "r") as f:
-            pitstops_carrera = f.readlines()
+calendarios = None
+lock_calendarios = threading.Lock()
 
-    return pitstops_carrera
+
+def inicio_carrera(carrera):
+    """
+    Function that returns the start (UTC) of a race of a schedule, at midnight if its time is unknown.
+    """
+    hora = (carrera["time"] or "00:00:00Z").rstrip("Z")
+    return datetime.datetime.fromisoformat(f"{carrera['date']}T{hora}").replace(
+        tzinfo=datetime.timezone.utc
+    )
+
+
+def temporada_terminada(calendario, ahora):
+    """
+    Function that tells whether every race of a schedule has already been run.
+    """
+    return all(
+        inicio_carrera(carrera) + DURACION_CARRERA <= ahora for carrera in calendario
+    )
+
+
+def calendario_temporada(anno, update=False, sesion=None, limitador=None, ahora=None):
+    """
+    Function that returns the schedule of a season as a list of {"round", "date", "time"}.
+    The schedule is downloaded once and kept in cache/calendarios.json. The schedule of a season that
+    has not finished yet is requested again (through the HTTP cache), since races can still change.
+    """
+    global calendarios
+    ahora = ahora or datetime.datetime.now(datetime.timezone.utc)
+    with lock_calendarios:
+        if calendarios is None:
+            calendarios = {}
+            if os.path.exists(calendarios_path):
+                with open(calendarios_path, "r", encoding="utf-8") as fich:
+                    calendarios = json.load(fich)
+        calendario = calendarios.get(str(anno))
+    if calendario is not None and not update and temporada_terminada(calendario, ahora):
+        return calendario
+
+    with obtener_metricas().stage("ergast.schedule", season=anno):
+        contenido = descargar_bytes(
+            f"{ERGAST_URL}/{anno}.json?limit=100", sesion, limitador
+        )
+        calendario = [
+            {"round": carrera.round, "date": carrera.date, "time": carrera.time}
+            for carrera in parse_schedule_json(contenido)
+        ]
+
+    # The file is rewritten as a whole and replaced, so it is never left half written
+    with lock_calendarios:
+        calendarios[str(anno)] = calendario
+        os.makedirs(os.path.dirname(calendarios_path), exist_ok=True)
+        with open(calendarios_path + ".tmp", "w", encoding="utf-8") as fich:
+            json.dump(calendarios, fich)
+        os.replace(calendarios_path + ".tmp", calendarios_path)
+    return calendario
+
+
+def carreras_disputadas(anno, update=False, sesion=None, limitador=None, ahora=None):
+    """
+    Function that returns the round numbers of the races of a season that have already been run.
+    """
+    ahora = ahora or datetime.datetime.now(datetime.timezone.utc)
+    return [
+        carrera["round"]
+        for carrera in calendario_temporada(anno, update, sesion, limitador, ahora)
+        if inicio_carrera(carrera) + DURACION_CARRERA <= ahora
+    ]
+
+
+def conseguir_pitstops_intervalo(
+    anno_inicial,
+    anno_final,
+    update=False,
+    crear_csv=False,
+    max_workers=8,
+    peticiones_por_segundo=None,
+    sesion=None,
+):
+    """
+    Function that retrieves concurrently the pitstops of every race in a range of Formula 1 seasons.
+    Only the races of the schedule of each season that have already been run are requested.
+    Returns a dictionary {(anno, carrera): lote} in season and race order.
+    """
+    sesion = sesion or crear_sesion(max_workers)
+    limitador = LimitadorPeticiones(peticiones_por_segundo)
+    carreras = [
+        (anno, carrera)
+        for anno in range(anno_inicial, anno_final + 1)
+        for carrera in carreras_disputadas(anno, update, sesion, limitador)
+    ]
+
+    # The threads share the session, so the TCP/TLS connections are reused
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futuros = [
+            executor.submit(
+                conseguir_pitstops_año_carrera,
+                anno,
+                carrera,
+                update,
+                crear_csv,
+                sesion,
+                limitador,
+            )
+            for anno, carrera in carreras
+        ]
+        return {unidad: futuro.result() for unidad, futuro in zip(carreras, futuros)}
 
 
 def crear_csv_pitstops_intervalo(
-    anno_inicial, anno_final, update=False, crear_general=False
+    anno_inicial,
+    anno_final,
+    update=False,
+    crear_general=False,
+    max_workers=8,
+    peticiones_por_segundo=None,
 ):
     """
     Function that creates or updates a CSV file with pitstop information for a range of Formula 1 races.
@@ -92,85 +484,55 @@ def crear_csv_pitstops_intervalo(
 
     # Check if the cache file doesn't exist or if update is requested
     if not os.path.exists(path) or update:
-        # Create a general CSV file with headers if requested
+        # Retrieve every race of the specified range of years concurrently
+        pitstops = conseguir_pitstops_intervalo(
+            anno_inicial,
+            anno_final,
+            update,
+            True,
+            max_workers,
+            peticiones_por_segundo,
+        )
+
+        # Create a general CSV file with every race if requested
         if crear_general:
-            with open(path, "w") as f:
-                f.write("piloto;parada;vuelta;hora;duracion;anno;carrera\n")
-
-        # Iterate over the specified range of years and races
-        for anno in range(anno_inicial, anno_final + 1):
-            for carrera in range(1, 25):
-                pitstops_carrera = conseguir_pitstops_año_carrera(
-                    anno, carrera, update, True
-                )
+            guardar_pitstops_csv(unir_lotes(pitstops.values()), path)
 
-                # Exclude the header line if creating a general CSV
-                if len(pitstops_carrera) > 1 and crear_general:
-                    pitstops_carrera.pop(
-                        0
-                    )  # Remove the first line: piloto;parada;vuelta;hora;duracion;anno;carrera
-                    with open(path, "a") as f:
-                        f.writelines(pitstops_carrera)
 
-
-patron_driverid = re.compile(r'<Driver driverId="([\w]+)"')
-patron_drivernumber = re.compile(r"<PermanentNumber>([\d]+)<\/PermanentNumber>")
-
-
-def mapping_pilotos_intervalo(anno_inicial, anno_final, update=False):
+def mapping_pilotos_intervalo(
+    anno_inicial, anno_final, update=False, sesion=None, registro=None
+):
     """
     Function that maps driver information for a specified range of Formula 1 seasons
+    Only the seasons missing from the driver registry (or all of them if update is requested) are downloaded,
+    together with the seasons that have not finished yet, whose drivers can still change.
     """
-    os.makedirs("cache", exist_ok=True)
-    pilotos = {}
+    registro = registro or obtener_registro()
+    annos = range(anno_inicial, anno_final + 1)
+    sesion = sesion or crear_sesion()
+    ahora = datetime.datetime.now(datetime.timezone.utc)
+    pendientes = [
+        anno
+        for anno in annos
+        if update
+        or not registro.has_season(anno)
+        or not temporada_terminada(calendario_temporada(anno, sesion=sesion), ahora)
+    ]
+
+    # The driver list of each season already includes the number and name of every driver
+    for anno in pendientes:
+        contenido = descargar_bytes(f"{ERGAST_URL}/{anno}/drivers.json", sesion)
+        pilotos_temporada = []
+        for piloto in parse_drivers_json(contenido):
+            registro.add(
+                piloto.driverId,
+                piloto.permanentNumber,
+                canonical_name(piloto.driverId, piloto.givenName, piloto.familyName),
+            )
+            pilotos_temporada.append(piloto.driverId)
+        registro.add_season(anno, pilotos_temporada)
 
-    # Iterate over the specified range of years
-    for anno in range(anno_inicial, anno_final + 1):
-        response = req.get(f"https://ergast.com/api/f1/{anno}/drivers")
-        contenido = response.content.decode("utf-8")
-        contenido = contenido.split("\n")
-        estado = 0
-
-        # Iterate over the API response to extract driver information
-        for linea in contenido:
-            if estado == 0:
-                busqueda = re.search(patron_driverid, linea)
-                if busqueda != None:
-                    nombre_piloto = busqueda.group(1)
-                    estado = 1
-            elif (
-                estado == 1
-            ):  # The line with the driver number always follows the driverId line if it exists
-                busqueda = re.search(patron_drivernumber, linea)
-                if busqueda == None:
-                    numero_piloto = "-1"  # sentinel value
-                else:
-                    numero_piloto = busqueda.group(1)
-                estado = 0
-
-                # Check if the driver is not already in the dictionary
-                if nombre_piloto not in pilotos:
-                    pilotos[nombre_piloto] = {"number": numero_piloto}
-                    info_piloto = req.get(
-                        f"https://ergast.com/api/f1/drivers/{nombre_piloto}.json"
-                    ).json()
-                    detalles_piloto = info_piloto["MRData"]["DriverTable"]["Drivers"][0]
-                    givenName = detalles_piloto["givenName"]
-                    familyName = detalles_piloto["familyName"]
-
-                    # Swap givenName and familyName for the driver named "zhou"
-                    if nombre_piloto == "zhou":
-                        givenName, familyName = familyName, givenName
-
-                    pilotos[nombre_piloto]["name"] = givenName + " " + familyName
-
-    # Write the mapped driver information to a JSON file
-    with open(
-        f"cache/pilotos_{anno_inicial}_{anno_final}.json", "w", encoding="utf-8"
-    ) as fich:
-        fich.write(json.dumps(pilotos, indent=4, ensure_ascii=False))
-
-    return pilotos
+    return registro.mapping(annos)
 
 
 def crear_banco_datos(anno_inicial, anno_final, update=False):
@@ -181,91 +543,278 @@ def crear_banco_datos(anno_inicial, anno_final, update=False):
     mapping_pilotos_intervalo(anno_inicial, anno_final, update)
 
 
-def func_pasar(tiempo: str):
+patron_duracion = r"^(?:(\d+):)?(\d+(?:\.\d+)?)$"
+
+
+def pasar_duraciones(duraciones):
     """
-    Function that converts a string representation of time to a numerical format (minutes).
+    Function that converts a Series of durations to seconds.
+    Durations of more than an hour become NaN.
     """
-    try:
-        n = tiempo.count(":")
-    except AttributeError:
-        return tiempo
-    if n == 0:
-        return float(tiempo)
-    if (
-        n > 1
-    ):  # If a pitstop takes more than an hour, it doesn't make sense to consider it
-        return None
-    min, secs = tiempo.split(":")
-    return float(min) * 60 + float(secs)
+    partes = duraciones.astype("string").str.extract(patron_duracion)
+    minutos = pd.to_numeric(partes[0]).fillna(0)
+    return minutos * 60 + pd.to_numeric(partes[1])
 
 
-def crear_csv_dataframes_intervalos(anno_inicial, anno_final, update=False):
+def agregar_pitstops(df_pitstops, numeros_pilotos, estadisticas_extra=False):
+    """
+    Function that aggregates the pitstops of every driver in every race of a table of pitstops.
+    """
+    df_pitstops = df_pitstops.assign(duracion=pasar_duraciones(df_pitstops["duracion"]))
+    agregaciones = {
+        "NPitstops": ("parada", "count"),
+        "MedianPitStopDuration": ("duracion", "median"),
+    }
+    if estadisticas_extra:
+        agregaciones["MeanPitStopDuration"] = ("duracion", "mean")
+        agregaciones["MinPitStopDuration"] = ("duracion", "min")
+        agregaciones["TotalPitStopDuration"] = ("duracion", "sum")
+
+    # The drivers keep the order in which they appear in each race
+    agregado = (
+        df_pitstops.groupby(["anno", "carrera", "piloto"], sort=False)
+        .agg(**agregaciones)
+        .reset_index()
+        .rename(
+            columns={"anno": "Season", "carrera": "RaceNumber", "piloto": "driverId"}
+        )
+    )
+    agregado.insert(
+        1,
+        "DriverNumber",
+        agregado["driverId"].map({k: v["number"] for k, v in numeros_pilotos.items()}),
+    )
+    agregado.insert(
+        2,
+        "Driver",
+        agregado["driverId"].map({k: v["name"] for k, v in numeros_pilotos.items()}),
+    )
+
+    # Same column order as the processed files: driverId, DriverNumber, Driver, ..., Season, RaceNumber
+    columnas = ["driverId", "DriverNumber", "Driver"] + list(agregaciones)
+    return agregado[columnas + ["Season", "RaceNumber"]]
+
+
+def procesar_pitstops(df_pitstops, numeros_pilotos, estadisticas_extra=False):
+    """
+    Function that aggregates a table of pitstops and writes the processed file of each race.
+    Returns the number of processed rows.
+    """
+    if not len(df_pitstops):
+        return 0
+    metricas = obtener_metricas()
+    metricas.count("ergast.pitstops", len(df_pitstops))
+
+    # Aggregate the pitstops of every driver of every race in a single pass
+    with metricas.stage("ergast.aggregate"):
+        agregado = agregar_pitstops(df_pitstops, numeros_pilotos, estadisticas_extra)
+    metricas.count("ergast.rows", len(agregado))
+
+    # Save the processed pitstop information of each race to a CSV file
+    with metricas.stage("ergast.write"):
+        for (anno, carrera), df_carrera in agregado.groupby(
+            ["Season", "RaceNumber"], sort=False
+        ):
+            os.makedirs(f"cache/procesado/{anno}", exist_ok=True)
+            df_carrera.to_csv(
+                f"cache/procesado/{anno}/pitstops_{anno}_{carrera}.csv",
+                index=False,
+                encoding="utf-8",
+            )
+    return len(agregado)
+
+
+def crear_csv_dataframes_intervalos(
+    anno_inicial,
+    anno_final,
+    update=False,
+    max_workers=8,
+    peticiones_por_segundo=None,
+    estadisticas_extra=False,
+    procesos=None,
+    memoria_maxima=None,
+    guardar_crudos=False,
+):
     """
     Function that creates or updates CSV files with processed pitstop information for a specified range of Formula 1 races.
+    The downloaded pitstops go straight to the aggregation; with guardar_crudos they are also saved to cache/{anno}.
+    With procesos, the seasons are processed in that many worker processes while the next seasons are downloaded,
+    and memoria_maxima (bytes of pitstops) limits the seasons downloaded that are still waiting to be processed.
     """
     os.makedirs("cache", exist_ok=True)
     os.makedirs("cache/procesado", exist_ok=True)
+    sesion = crear_sesion(max_workers)
+    metricas = obtener_metricas()
 
     # Create or update driver information mapping
-    mapping_pilotos_intervalo(anno_inicial, anno_final, update)
+    with metricas.stage("ergast.drivers"):
+        numeros_pilotos = mapping_pilotos_intervalo(
+            anno_inicial, anno_final, update, sesion
+        )
+
+    if procesos:
+        with metricas.stage("ergast.parallel", processes=procesos):
+            procesar_temporadas_en_paralelo(
+                range(anno_inicial, anno_final + 1),
+                numeros_pilotos,
+                update,
+                max_workers,
+                peticiones_por_segundo,
+                sesion,
+                estadisticas_extra,
+                procesos,
+                memoria_maxima,
+                guardar_crudos,
+            )
+        return
+
+    # Download the pitstops of every race concurrently before processing them
+    with metricas.stage("ergast.fetch"):
+        pitstops = conseguir_pitstops_intervalo(
+            anno_inicial,
+            anno_final,
+            update,
+            guardar_crudos,
+            max_workers,
+            peticiones_por_segundo,
+            sesion,
+        )
+
+    # Join every race of the specified range into a single table and process it
+    procesar_pitstops(
+        unir_lotes(pitstops.values()), numeros_pilotos, estadisticas_extra
+    )
+
+
+def procesar_temporadas_en_paralelo(
+    annos,
+    numeros_pilotos,
+    update,
+    max_workers,
+    peticiones_por_segundo,
+    sesion,
+    estadisticas_extra,
+    procesos,
+    memoria_maxima,
+    guardar_crudos=False,
+):
+    """
+    Function that downloads the seasons one after another (producer) and sends each downloaded season to a
+    process pool (consumers), so the downloads of a season overlap with the processing of the previous ones.
+    Every race is written to its own processed file, so the result does not depend on the order of the workers.
+    """
+    metricas = obtener_metricas()
+    en_curso = []
+    futuros = []
+    # spawn avoids forking a process that has download threads running
+    contexto = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto) as executor:
+        for anno in annos:
+            # Wait while the seasons waiting to be processed exceed the memory budget
+            en_curso = [(f, tamano) for f, tamano in en_curso if not f.done()]
+            while memoria_maxima and en_curso:
+                if sum(tamano for _, tamano in en_curso) <= memoria_maxima:
+                    break
+                en_curso.pop(0)[0].result()
+
+            with metricas.stage("ergast.fetch", season=anno):
+                pitstops = conseguir_pitstops_intervalo(
+                    anno,
+                    anno,
+                    update,
+                    guardar_crudos,
+                    max_workers,
+                    peticiones_por_segundo,
+                    sesion,
+                )
+            df_pitstops = unir_lotes(pitstops.values())
+            tamano = int(df_pitstops.memory_usage(deep=True).sum())
+            futuro = executor.submit(
+                procesar_pitstops, df_pitstops, numeros_pilotos, estadisticas_extra
+            )
+            en_curso.append((futuro, tamano))
+            futuros.append(futuro)
 
-    # Load driver numbers from the mapping file
-    with open(
-        f"cache/pilotos_{anno_inicial}_{anno_final}.json", "r", encoding="utf-8"
-    ) as fich_pilotos:
-        numeros_pilotos = json.load(fich_pilotos)
+        for futuro in futuros:
+            metricas.count("ergast.rows", futuro.result())
 
-    # Process pitstop information for each race in the specified range
-    for anno in range(anno_inicial, anno_final + 1):
-        os.makedirs(f"cache/procesado/{anno}", exist_ok=True)
-        for carrera in range(1, 25):
-            pitstops_carrera = conseguir_pitstops_año_carrera(
-                anno, carrera, update, True
+
+def lote_vueltas(vueltas):
+    """
+    Function that converts a list of LapTime records to a batch {column: NumPy array} of the lap store.
+    The times are converted to milliseconds at once for the whole batch.
+    """
+    columnas = list(zip(*vueltas)) if vueltas else [()] * 6
+    return {
+        "Season": np.array(columnas[4], dtype=np.int16),
+        "RaceNumber": np.array(columnas[5], dtype=np.int16),
+        "driverId": np.array(columnas[0], dtype=object),
+        "Lap": np.array(columnas[1], dtype=np.int16),
+        "Position": np.array(columnas[2], dtype=np.int16),
+        "Milliseconds": lap_times_to_ms(columnas[3]),
+    }
+
+
+def conseguir_vueltas_año_carrera(anno, num_carrera, sesion=None, limitador=None):
+    """
+    Function that retrieves the lap timings of a Formula 1 race as a batch (see lote_vueltas).
+    """
+    with obtener_metricas().stage("ergast.laps", season=anno, race=num_carrera):
+        vueltas = []
+        offset = 0
+        total = None
+
+        # Ergast pages the timings of every driver in every lap (about 1,000 per race)
+        while total is None or offset < total:
+            contenido = descargar_bytes(
+                f"{ERGAST_URL}/{anno}/{num_carrera}/laps.json"
+                f"?limit={LIMITE_PAGINA}&offset={offset}",
+                sesion,
+                limitador,
             )
+            meta = {}
+            vueltas.extend(parse_laps_json(contenido, meta))
+            total = int(meta.get("total", 0))
+            offset += LIMITE_PAGINA
 
-            # Process pitstop data if there is information available
-            if len(pitstops_carrera) > 1:
-                path = f"cache/{anno}/{anno}_{carrera}.csv"
-                df_carrera = pd.read_csv(path, sep=";")
-                df_carrera["duracion"] = df_carrera["duracion"].apply(func_pasar)
-
-                # Create a dictionary to store processed pitstop information
-                dicti = {
-                    "driverId": [],
-                    "DriverNumber": [],
-                    "Driver": [],
-                    "NPitstops": [],
-                    "MedianPitStopDuration": [],
-                }
-                indi = []
-                i = 0
-
-                # Iterate over unique drivers in the race
-                for piloto in df_carrera["piloto"].unique():
-                    df_carrera_piloto = df_carrera.loc[df_carrera["piloto"] == piloto]
-
-                    # Populate the dictionary with processed information
-                    dicti["driverId"].append(piloto)
-                    dicti["DriverNumber"].append(numeros_pilotos[piloto]["number"])
-                    dicti["Driver"].append(numeros_pilotos[piloto]["name"])
-                    dicti["MedianPitStopDuration"].append(
-                        df_carrera_piloto["duracion"].median()
+        return lote_vueltas(vueltas)
+
+
+def crear_vueltas_intervalo(
+    anno_inicial,
+    anno_final,
+    update=False,
+    max_workers=8,
+    peticiones_por_segundo=None,
+):
+    """
+    Function that creates or updates the lap store of every season of a range (cache/laps/laps_{anno}.npz)
+    and returns the lap store of the whole range. Only the seasons with new races are downloaded.
+    """
+    sesion = crear_sesion(max_workers)
+    limitador = LimitadorPeticiones(peticiones_por_segundo)
+    metricas = obtener_metricas()
+
+    for anno in range(anno_inicial, anno_final + 1):
+        carreras = carreras_disputadas(anno, update, sesion, limitador)
+        path = season_path(anno)
+        if os.path.exists(path) and not update:
+            if set(LapStore.load(path).races()) >= {(anno, c) for c in carreras}:
+                continue
+
+        # The races of a season are downloaded concurrently and stored together
+        with metricas.stage("ergast.laps_season", season=anno):
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                lotes = list(
+                    executor.map(
+                        lambda carrera: conseguir_vueltas_año_carrera(
+                            anno, carrera, sesion, limitador
+                        ),
+                        carreras,
                     )
-                    dicti["NPitstops"].append(df_carrera_piloto["parada"].count())
-                    indi.append(i)
-                    i += 1
-
-                # Create a DataFrame from the dictionary
-                df_carrera = pd.DataFrame(data=dicti, index=indi)
-                df_carrera["Season"] = anno
-                df_carrera["RaceNumber"] = carrera
-
-                # Save the processed pitstop information to a CSV file
-                df_carrera.to_csv(
-                    f"cache/procesado/{anno}/pitstops_{anno}_{carrera}.csv",
-                    index=False,
-                    encoding="utf-8",
                 )
+            almacen = LapStore.from_batches(lotes)
+            almacen.save(path)
+        metricas.count("ergast.laps", len(almacen))
 
-        # Eliminate previous directory
-        shutil.rmtree(f"cache/{anno}")
+    return load_lap_store(range(anno_inicial, anno_final + 1))
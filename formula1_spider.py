@@ -13,12 +13,275 @@ Integrantes del grupo:
 Descripción:
 El objetivo del crawler es hacer web scraping de la página web de Wikipedia de las distintas temporadas de Formula 1 (desde 2012 hasta la actualidad)"""
 
-from numpy import isin
 import scrapy
+from scrapy import signals
 from scrapy.crawler import CrawlerProcess
+from scrapy.http import HtmlResponse
 import pandas as pd
 import re
 import os
+import shutil
+import time
+from http_cache import obtener_cache
+from metrics import obtener_metricas
+from storage import dataset_path, get_storage, replace_partitions
+
+
+# Directory of the results store written by the spider.
+results_store_path = os.path.join("cache", "spider_store")
+
+# Columns of the race classification table.
+RESULT_COLUMNS = [
+    "Pos",
+    "DriverNumber",
+    "Driver",
+    "Constructor",
+    "Laps",
+    "Time/Retired",
+    "Grid",
+    "Points",
+]
+RESULTS_STORE_COLUMNS = RESULT_COLUMNS + ["RaceNumber", "Season", "RaceName"]
+
+
+# Base URL of Wikipedia. It can be pointed at a local stub server for testing.
+WIKIPEDIA_URL = "https://en.wikipedia.org/wiki"
+
+
+class ResponseCacheMiddleware:
+    """
+    Downloader middleware that serves the Wikipedia pages from the HTTP cache shared with the Ergast module.
+    """
+
+    def __init__(self, crawler=None):
+        self.crawler = crawler
+        self.cache = obtener_cache()
+        self.metricas = obtener_metricas()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_request(self, request):
+        """
+        Method that answers from the cache when the page is fresh, or makes the request conditional when it is stale.
+        """
+        guardada = self.cache.get(request.url)
+        if guardada is None:
+            return None
+        if guardada.fresh:
+            self.metricas.count("wikipedia.cache_hits")
+            return HtmlResponse(
+                request.url,
+                body=guardada.body,
+                encoding="utf-8",
+                request=request,
+                flags=["cached"],
+            )
+        request.meta["cached_response"] = guardada
+        for cabecera, valor in guardada.conditional_headers().items():
+            request.headers[cabecera] = valor
+        return None
+
+    def process_response(self, request, response):
+        """
+        Method that stores the downloaded pages and resolves 304 Not Modified answers from the cache.
+        """
+        if "cached" in response.flags:
+            return response
+        self.metricas.count("wikipedia.http_requests")
+        self.metricas.count("wikipedia.http_bytes", len(response.body))
+        guardada = request.meta.get("cached_response")
+        if response.status == 304 and guardada is not None:
+            self.metricas.count("wikipedia.cache_revalidated")
+            self.cache.refresh(request.url)
+            return HtmlResponse(
+                request.url,
+                body=guardada.body,
+                encoding="utf-8",
+                request=request,
+                flags=["cached"],
+            )
+        if response.status == 200:
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            self.cache.put(
+                request.url,
+                response.body,
+                etag.decode() if etag else None,
+                last_modified.decode() if last_modified else None,
+            )
+        return response
+
+
+def crawler_settings(
+    concurrency=8, jobdir="cache/spider_job", autothrottle=True, store_format="csv"
+):
+    """
+    Function that returns the Scrapy settings of a tuned crawl.
+    The pages are cached by ResponseCacheMiddleware and the pending requests are kept in jobdir,
+    so an interrupted crawl resumes where it stopped.
+    """
+    settings = {
+        "CONCURRENT_REQUESTS": concurrency * 2,
+        "CONCURRENT_REQUESTS_PER_DOMAIN": concurrency,
+        "AUTOTHROTTLE_ENABLED": autothrottle,
+        "AUTOTHROTTLE_TARGET_CONCURRENCY": concurrency,
+        "AUTOTHROTTLE_START_DELAY": 0.25,
+        "LOG_LEVEL": "INFO",
+        "RESULTS_STORE_FORMAT": store_format,
+    }
+    if jobdir:
+        settings["JOBDIR"] = jobdir
+    return settings
+
+
+# Item with one row of a race classification ("Time/Retired" is not a valid attribute name).
+RaceResultItem = type(
+    "RaceResultItem",
+    (scrapy.Item,),
+    {
+        "__doc__": "Item with one row of the classification of a race.",
+        **{column: scrapy.Field() for column in RESULTS_STORE_COLUMNS},
+    },
+)
+
+
+class RaceResultsPipeline:
+    """
+    Item pipeline that cleans the classification rows as they arrive and writes them in batches
+    to the results store (cache/spider_store.csv, .parquet...), partitioned by Season.
+    """
+
+    def __init__(self, path, format, batch_size, staging_path=None, crawler=None):
+        self.crawler = crawler
+        self.path = path
+        # The staging store of a resumable crawl lives in its job directory and is kept across resumes
+        self.resumable = staging_path is not None
+        self.staging_path = staging_path or path + ".tmp"
+        self.storage = get_storage(format)
+        self.batch_size = batch_size
+        self.batch = []
+        self.n_batches = 0
+        # Batches of a resumed crawl must not overwrite the batches written before the stop
+        self.run_id = time.time_ns()
+        self.finished_races = set()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        format = crawler.settings.get("RESULTS_STORE_FORMAT", "csv")
+        jobdir = crawler.settings.get("JOBDIR")
+        pipeline = cls(
+            crawler.settings.get(
+                "RESULTS_STORE_PATH", dataset_path(results_store_path, format)
+            ),
+            format,
+            crawler.settings.getint("RESULTS_BATCH_SIZE", 500),
+            os.path.join(jobdir, "results_staging") if jobdir else None,
+            crawler,
+        )
+        crawler.signals.connect(pipeline.publish, signal=signals.spider_closed)
+        return pipeline
+
+    def open_spider(self):
+        if not self.resumable:
+            shutil.rmtree(self.staging_path, ignore_errors=True)
+
+    def process_item(self, item):
+        """
+        Method that removes the rows after the table (Source..., Fastest...) and the footnotes of Pos, DriverNumber and Grid.
+        """
+        race = (item["Season"], item["RaceNumber"])
+        pos = item.get("Pos") or ""
+        if race in self.finished_races:
+            return item
+        if "Source" in pos or "Fastest" in pos:
+            self.finished_races.add(race)
+            return item
+        if not item.get("Constructor"):
+            return item
+
+        row = {column: item.get(column) for column in RESULTS_STORE_COLUMNS}
+        for column in ["Pos", "DriverNumber", "Grid"]:
+            if isinstance(row[column], str):
+                row[column] = row[column].split(" ")[0]
+        self.batch.append(row)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+        return item
+
+    def flush(self):
+        """
+        Method that writes the buffered rows to the staging store.
+        """
+        if self.batch:
+            metricas = obtener_metricas()
+            with metricas.stage("spider.write"):
+                self.storage.write_partitions(
+                    pd.DataFrame(self.batch, columns=RESULTS_STORE_COLUMNS),
+                    self.staging_path,
+                    f"part-{self.run_id}-{self.n_batches}",
+                )
+            metricas.count("spider.rows", len(self.batch))
+            self.n_batches += 1
+            self.batch = []
+
+    def close_spider(self):
+        """
+        Method that writes the last buffered rows to the staging store.
+        """
+        self.flush()
+
+    def publish(self, reason):
+        """
+        Method that replaces the crawled seasons of the results store with the new rows, only if the crawl finished.
+        The staging store of an interrupted crawl only has some races of its seasons, so it is kept
+        (in the job directory) until the resumed crawl finishes.
+        """
+        if reason == "finished" and os.path.exists(self.staging_path):
+            replace_partitions(self.staging_path, self.path)
+
+
+# Headers that identify the tables of the pages.
+RACE_TABLE_SIGNATURE = {
+    "pos",
+    "no",
+    "driver",
+    "constructor",
+    "laps",
+    "time/retired",
+    "grid",
+    "points",
+}
+GRAND_PRIX_TABLE_SIGNATURE = {"round", "grand prix", "report"}
+
+patron_cabecera = re.compile(r"\[[^\]]*\]|\.|\s+(?=/)|(?<=/)\s+")
+
+
+def normalize_header(text):
+    """
+    Function that normalises the text of a header cell: "Pos. [a]" -> "pos", "Time / Retired" -> "time/retired".
+    """
+    return re.sub(patron_cabecera, "", " ".join(text.split())).strip().lower()
+
+
+def find_table(response, signature, min_score, required=None):
+    """
+    Function that scores every table of the page by the headers of its first row that belong to the signature,
+    and returns the best one (the last one if several tables have the same score), or None.
+    """
+    best_table, best_score = None, 0
+    for table in response.xpath("//table[contains(@class, 'wikitable')]"):
+        headers = {
+            normalize_header(" ".join(th.xpath(".//text()").getall()))
+            for th in table.xpath("(.//tr)[1]/th")
+        }
+        score = len(headers & signature)
+        if required is not None and required not in headers:
+            continue
+        if score >= min_score and score >= best_score:
+            best_table, best_score = table, score
+    return best_table
 
 
 class F1Scraper(scrapy.Spider):
@@ -27,16 +290,29 @@ class F1Scraper(scrapy.Spider):
     """
 
     name = "formula1"
-    # Generate start URLs for the different Formula 1 seasons
-    start_urls = [
-        f"https://en.wikipedia.org/wiki/{year}_Formula_One_World_Championship"
-        for year in range(2012, 2024)
-    ]
+    custom_settings = {
+        "DOWNLOADER_MIDDLEWARES": {"formula1_spider.ResponseCacheMiddleware": 480},
+        "ITEM_PIPELINES": {"formula1_spider.RaceResultsPipeline": 300},
+    }
+
+    def __init__(self, seasons=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Generate start URLs for the different Formula 1 seasons
+        seasons = range(2012, 2024) if seasons is None else seasons
+        self.start_urls = [
+            f"{WIKIPEDIA_URL}/{year}_Formula_One_World_Championship" for year in seasons
+        ]
+        self.season_stats = {}
 
     def parse(self, response):
         """
         Method that parses the response from the page and extracts links to race reports.
         """
+        season = re.search(r"/(\d{4})_", response.url).group(1)
+        self.season_stats.setdefault(
+            season, {"start": time.monotonic(), "end": None, "pages": 0, "rows": 0}
+        )
+
         # Find the table containing Grand Prix information
         grands_prix_table = self.find_grand_prix_table(response)
         i = 1
@@ -48,7 +324,7 @@ class F1Scraper(scrapy.Spider):
                 yield scrapy.Request(
                     response.urljoin(report_link),
                     callback=self.parse_report,
-                    meta={"race_number": i},
+                    meta={"race_number": i, "season": season},
                 )
                 i += 1
 
@@ -56,49 +332,84 @@ class F1Scraper(scrapy.Spider):
         """
         Method that searches for the grand prix table in the HTML response.
         """
-
-        for table in response.xpath('//table[@class="wikitable sortable"]'):
-            if "Report" in table.xpath(".//th//text()").extract():
-                return table
+        return find_table(
+            response, GRAND_PRIX_TABLE_SIGNATURE, min_score=2, required="report"
+        )
 
     def parse_report(self, response):
         """
         Method that analyzes the response from the race report page and extracts the information.
         """
-
-        # Extract year and Grand Prix name from the report title
-        year, prix = self.extract_year_and_prix(response)
-        if not year:
-            year = "2020"  # 70th Anniversary Grand Prix (2020) doesn't match any year
-
-        # Create a directory for each year if it doesn't exist
-        path = self.create_directory(year, prix)
-
-        # Depending on the year and the prix, the race classification table has a different format.
-        race_table = self.get_race_table(response, year, prix)
-
-        # Extract race data from the table
-        rows = self.extract_race_data(race_table)
-
-        column_names = [
-            "Pos",
-            "DriverNumber",
-            "Driver",
-            "Constructor",
-            "Laps",
-            "Time/Retired",
-            "Grid",
-            "Points",
-        ]
-
-        # Create a DataFrame with the extracted data
-        df = pd.DataFrame(rows, columns=column_names)
-
         race_number = response.meta.get("race_number")
-        df["RaceNumber"] = race_number
-        df["Season"] = year
-        df["RaceName"] = prix
-        df.to_csv(path, index=False)
+        with obtener_metricas().stage(
+            "spider.parse_report",
+            season=response.meta.get("season"),
+            race=race_number,
+        ):
+            # Extract year and Grand Prix name from the report title
+            year, prix = self.extract_year_and_prix(response)
+            if not year:
+                # 70th Anniversary Grand Prix (2020) doesn't match any year
+                year = "2020"
+
+            # The race classification table is recognised by its header, whatever the year and the prix.
+            race_table = self.get_race_table(response)
+            if race_table is None:
+                # Report pages of races not run yet have no classification table
+                self.logger.warning(f"No race table found in {response.url}")
+                return
+
+            # Extract race data from the table
+            rows = self.extract_race_data(race_table)
+
+        self.update_season_stats(response.meta.get("season"), len(rows))
+
+        # Every row of the table is sent to RaceResultsPipeline
+        for row in rows:
+            item = RaceResultItem(
+                RaceNumber=race_number, Season=int(year), RaceName=prix
+            )
+            for column, value in zip(RESULT_COLUMNS, row):
+                item[column] = value
+            yield item
+
+    def update_season_stats(self, season, rows):
+        """
+        Method that counts the pages and rows extracted for a season.
+        """
+        stats = self.season_stats.get(season)
+        if stats is None:
+            return
+        stats["pages"] += 1
+        stats["rows"] += rows
+        stats["end"] = time.monotonic()
+
+    def closed(self, reason):
+        """
+        Method called when the crawl ends that reports the time and items of each season.
+        """
+        for season, stats in sorted(self.season_stats.items()):
+            end = stats["end"] or stats["start"]
+            self.logger.info(
+                f"Season {season}: {stats['pages']} races, {stats['rows']} rows "
+                f"in {end - stats['start']:.2f}s"
+            )
+        self.finish_reason = reason
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.remove_jobdir, signal=signals.engine_stopped)
+        return spider
+
+    def remove_jobdir(self):
+        """
+        Method that removes the job directory once the engine has stopped and written its state,
+        if the crawl finished, so that the next crawl starts from scratch (with its staging store of results).
+        """
+        jobdir = self.settings.get("JOBDIR")
+        if getattr(self, "finish_reason", None) == "finished" and jobdir:
+            shutil.rmtree(jobdir, ignore_errors=True)
 
     def extract_year_and_prix(self, response):
         """
@@ -111,68 +422,11 @@ class F1Scraper(scrapy.Spider):
         prix = report_title.lstrip(f"{year} ").rstrip(" - Wikipedia")
         return year, prix
 
-    def create_directory(self, year, prix):
-        """
-        Method that creates a directory for each year and Grand Prix if it doesn't exist.
-        """
-        year = os.path.join("cache", "spider", year)
-        os.makedirs(year, exist_ok=True)
-        return os.path.join(year, f"{prix}.csv")
-
-    def get_race_table(self, response, year, prix):
-        """
-        Method that determines the correct race table based on the year and Grand Prix name.
-        """
-
-        # Conditions for different years and Grands Prix
-        if year in ["2015", "2016"]:
-            race_table = response.xpath('//table[@class="wikitable"]')
-
-        elif year == "2012":
-            if prix == "Spanish Grand Prix":
-                race_table = response.xpath('//table[@class="wikitable sortable"]')[-1]
-            else:
-                race_table = response.xpath('//table[@class="wikitable"]')
-
-        elif year == "2013":
-            if prix in ["Malaysian Grand Prix", "British Grand Prix"]:
-                race_table = response.xpath('//table[@class="wikitable sortable"]')[-1]
-            else:
-                race_table = response.xpath('//table[@class="wikitable"]')
-
-        elif year == "2014":
-            if prix in [
-                "Abu Dhabi Grand Prix",
-                "Australian Grand Prix",
-                "Austrian Grand Prix",
-                "Chinese Grand Prix",
-                "German Grand Prix",
-                "Hungarian Grand Prix",
-                "Malaysian Grand Prix",
-                "Russian Grand Prix",
-            ]:
-                race_table = response.xpath('//table[@class="wikitable"]')
-            else:
-                race_table = response.xpath('//table[@class="wikitable sortable"]')[-1]
-
-        elif year == "2017":
-            if prix in [
-                "Chinese Grand Prix",
-                "Bahrain Grand Prix",
-                "Spanish Grand Prix",
-                "Monaco Grand Prix",
-                "Canadian Grand Prix",
-                "Azerbaijan Grand Prix",
-                "Austrian Grand Prix",
-                "British Grand Prix",
-            ]:
-                race_table = response.xpath('//table[@class="wikitable sortable"]')[-1]
-            else:
-                race_table = response.xpath('//table[@class="wikitable"]')
-        else:
-            race_table = response.xpath('//table[@class="wikitable sortable"]')[-1]
-
-        return race_table
+    def get_race_table(self, response):
+        """
+        Method that determines the race classification table by the header of every table of the page.
+        """
+        return find_table(response, RACE_TABLE_SIGNATURE, min_score=6)
 
     def extract_race_data(self, race_table):
         """
@@ -189,10 +443,27 @@ class F1Scraper(scrapy.Spider):
         return rows
 
 
-def setup_crawler():
+def setup_crawler(
+    seasons=None, concurrency=8, jobdir="cache/spider_job", store_format="csv"
+):
     """
     Setups Scrapy crawler
     """
-    process = CrawlerProcess()
-    process.crawl(F1Scraper)
+    process = CrawlerProcess(
+        crawler_settings(concurrency, jobdir, store_format=store_format)
+    )
+    process.crawl(F1Scraper, seasons=seasons)
     return process
+
+
+def run_crawler(
+    seasons=None, concurrency=8, jobdir="cache/spider_job", store_format="csv"
+):
+    """
+    Function that runs the crawl of some seasons and returns its finish reason ("finished" if it was not interrupted).
+    The results are only published to the results store when the crawl finished.
+    """
+    process = setup_crawler(seasons, concurrency, jobdir, store_format)
+    crawler = next(iter(process.crawlers))
+    process.start()
+    return crawler.stats.get_value("finish_reason")
@@ -13,109 +13,271 @@ Integrantes del grupo:
 Descripción:
 Funciones destinadas a representar los gráficos empleados en el informe.pdf"""
 
+import os
 import pandas as pd
-import matplotlib.pyplot as plt
-from dataframe import create_df
+from concurrent.futures import ProcessPoolExecutor
+from dataframe import load_df
+from metrics import obtener_metricas
 
 
-def plot_median_pitstop_duration_by_team(df):
+# Columns of the merged dataframe used by the charts.
+GRAPH_COLUMNS = [
+    "Driver",
+    "Constructor",
+    "RaceName",
+    "Season",
+    "Laps",
+    "Points",
+    "NPitstops",
+    "MedianPitStopDuration",
+]
+
+# Dimensions and measures of the aggregate cube shared by the charts.
+CUBE_DIMENSIONS = ["Constructor", "RaceName", "Season", "Driver"]
+CUBE_MEASURES = ["Points", "Laps", "NPitstops", "MedianPitStopDuration"]
+
+
+def load_graph_df(format="csv"):
     """
-    Chart of the average pit-stop duration per team with the fastest team highlighted.
+    Function that reads from the saved merged dataframe only the columns needed by the charts.
+    """
+    return load_df(columns=GRAPH_COLUMNS, format=format)
+
+
+class AggregateCube:
+    """
+    Class that computes once the sums and counts of the measures by (Constructor, RaceName, Season, Driver).
+    Every chart is a roll-up of the cube to one dimension, so the merged dataframe is grouped only once.
+    The input dataframe is not modified.
+    """
+
+    def __init__(self, df):
+        medidas = pd.DataFrame(
+            {col: pd.to_numeric(df[col], errors="coerce") for col in CUBE_MEASURES}
+        )
+        self.cube = medidas.groupby(
+            [df[col] for col in CUBE_DIMENSIONS], dropna=False, observed=True
+        ).agg(["sum", "count"])
+        # Medians cannot be combined from partial results, they are kept per constructor
+        self.team_medians = (
+            medidas["MedianPitStopDuration"]
+            .groupby(df["Constructor"], observed=True)
+            .median()
+        )
+
+    def sum(self, dimension, measure):
+        """
+        Method that returns the sum of a measure by one dimension.
+        """
+        return self.cube[(measure, "sum")].groupby(level=dimension).sum()
+
+    def mean(self, dimension, measure):
+        """
+        Method that returns the mean of a measure by one dimension.
+        """
+        grupos = self.cube[measure].groupby(level=dimension)
+        return grupos["sum"].sum() / grupos["count"].sum()
+
+
+def draw_median_pitstop_duration_by_team(team_median_pitstops, ax):
+    """
+    Function that draws the median pit-stop duration per team with the fastest team highlighted.
     """
-    team_median_pitstops = (
-        df.groupby("Constructor")["MedianPitStopDuration"].median().sort_values()
-    )
     colors = ["skyblue" if i > 0 else "blue" for i in range(len(team_median_pitstops))]
-    team_median_pitstops.plot(kind="bar", figsize=(12, 6), color=colors)
+    team_median_pitstops.plot(kind="bar", color=colors, ax=ax)
 
-    plt.title("Duración Media de Pit-Stops por Equipo")
-    plt.xlabel("Equipo")
-    plt.ylabel("Duración Media (segundos)")
-    plt.tight_layout()
-    plt.show()
+    ax.set_title("Duración Media de Pit-Stops por Equipo")
+    ax.set_xlabel("Equipo")
+    ax.set_ylabel("Duración Media (segundos)")
 
 
-def plot_average_pitstops_per_race(df):
+def draw_average_pitstops_per_race(average_pitstops, ax):
     """
-    Chart of the average pit stops per race with the race with the fewest average pit stops highlighted.
+    Function that draws the average pit stops per race with the race with the fewest highlighted.
     """
-    average_pitstops = df.groupby("RaceName")["NPitstops"].mean().sort_values()
     colors = ["skyblue" if i > 0 else "green" for i in range(len(average_pitstops))]
-    average_pitstops.plot(kind="bar", figsize=(12, 6), color=colors)
+    average_pitstops.plot(kind="bar", color=colors, ax=ax)
 
-    plt.title("Media de Pit-Stops por Carrera")
-    plt.xlabel("Carrera")
-    plt.ylabel("Media de Pit-Stops")
-    plt.xticks(rotation=90)
-    plt.tight_layout()
-    plt.show()
+    ax.set_title("Media de Pit-Stops por Carrera")
+    ax.set_xlabel("Carrera")
+    ax.set_ylabel("Media de Pit-Stops")
+    ax.tick_params(axis="x", labelrotation=90)
 
 
-def plot_average_pitstop_duration_by_season(df):
+def draw_average_pitstop_duration_by_season(avg_duration_by_season, ax):
     """
-    Chart of the average pit-stop duration per season.
+    Function that draws the average pit-stop duration per season.
     """
-    avg_duration_by_season = df.groupby("Season")["MedianPitStopDuration"].mean()
-    avg_duration_by_season.plot(kind="line", marker="o", figsize=(10, 5))
+    avg_duration_by_season.plot(kind="line", marker="o", ax=ax)
 
-    plt.title("Duración Promedio de Pit-Stops por Temporada")
-    plt.xlabel("Temporada")
-    plt.ylabel("Duración Promedio (segundos)")
-    plt.grid(True)
-    plt.tight_layout()
-    plt.show()
+    ax.set_title("Duración Promedio de Pit-Stops por Temporada")
+    ax.set_xlabel("Temporada")
+    ax.set_ylabel("Duración Promedio (segundos)")
+    ax.grid(True)
 
 
-def plot_average_pitstops_by_season(df):
+def draw_average_pitstops_by_season(avg_pitstops_by_season, ax):
     """
-    Chart of the average number of pit stops per race per season.
+    Function that draws the average number of pit stops per race per season.
     """
-    avg_pitstops_by_season = df.groupby("Season")["NPitstops"].mean()
-    avg_pitstops_by_season.plot(kind="line", marker="o", figsize=(10, 5), color="green")
+    avg_pitstops_by_season.plot(kind="line", marker="o", color="green", ax=ax)
 
-    plt.title("Número Promedio de Pit-Stops por Carrera por Temporada")
-    plt.xlabel("Temporada")
-    plt.ylabel("Número Promedio de Pit-Stops por Carrera")
-    plt.grid(True)
-    plt.tight_layout()
-    plt.show()
+    ax.set_title("Número Promedio de Pit-Stops por Carrera por Temporada")
+    ax.set_xlabel("Temporada")
+    ax.set_ylabel("Número Promedio de Pit-Stops por Carrera")
+    ax.grid(True)
 
 
-def plot_points_by_drivers(df):
+def draw_points_by_drivers(top_10_drivers, ax):
     """
-    Chart of the accumulated points by the top 10 drivers.
+    Function that draws the accumulated points of the top 10 drivers.
     """
-    df["Points"] = pd.to_numeric(df["Points"], errors="coerce")
-    df["Points"].fillna(0, inplace=True)
-    top_10_drivers = (
-        df.groupby("Driver")["Points"].sum().sort_values(ascending=False).head(10)
-    )
     colors = ["green" if i == max(top_10_drivers) else "blue" for i in top_10_drivers]
-    top_10_drivers.plot(kind="bar", color=colors, figsize=(10, 6))
+    top_10_drivers.plot(kind="bar", color=colors, ax=ax)
 
-    plt.title("Top 10 Pilotos con Más Puntos Acumulados")
-    plt.xlabel("Piloto")
-    plt.ylabel("Puntos Acumulados")
-    plt.xticks(rotation=45)
-    plt.tight_layout()
+    ax.set_title("Top 10 Pilotos con Más Puntos Acumulados")
+    ax.set_xlabel("Piloto")
+    ax.set_ylabel("Puntos Acumulados")
+    ax.tick_params(axis="x", labelrotation=45)
+
+
+def draw_laps_led_by_constructor(laps_led_by_constructor, ax):
+    """
+    Function that draws the total number of laps led by each constructor.
+    """
+    ax.bar(laps_led_by_constructor.index, laps_led_by_constructor.values, color="navy")
+    ax.set_title("Total de Vueltas Lideradas por Constructor")
+    ax.set_xlabel("Constructor")
+    ax.set_ylabel("Vueltas Lideradas")
+    ax.tick_params(axis="x", labelrotation=45)
+
+
+# Charts of the report: name -> (aggregate of the cube, drawing function, size of the figure).
+CHARTS = {
+    "median_pitstop_duration_by_team": (
+        lambda cube: cube.team_medians.sort_values(),
+        draw_median_pitstop_duration_by_team,
+        (12, 6),
+    ),
+    "average_pitstops_per_race": (
+        lambda cube: cube.mean("RaceName", "NPitstops").sort_values(),
+        draw_average_pitstops_per_race,
+        (12, 6),
+    ),
+    "average_pitstop_duration_by_season": (
+        lambda cube: cube.mean("Season", "MedianPitStopDuration"),
+        draw_average_pitstop_duration_by_season,
+        (10, 5),
+    ),
+    "average_pitstops_by_season": (
+        lambda cube: cube.mean("Season", "NPitstops"),
+        draw_average_pitstops_by_season,
+        (10, 5),
+    ),
+    "points_by_drivers": (
+        lambda cube: cube.sum("Driver", "Points").sort_values(ascending=False).head(10),
+        draw_points_by_drivers,
+        (10, 6),
+    ),
+    "laps_led_by_constructor": (
+        lambda cube: cube.sum("Constructor", "Laps").sort_values(ascending=False),
+        draw_laps_led_by_constructor,
+        (14, 7),
+    ),
+}
+
+
+def show_chart(name, df, cube=None):
+    """
+    Function that shows a chart of the report in a window.
+    """
+    # matplotlib is only imported when a chart is drawn
+    import matplotlib.pyplot as plt
+
+    if cube is None:
+        cube = AggregateCube(df)
+    aggregate, draw, figsize = CHARTS[name]
+    fig, ax = plt.subplots(figsize=figsize)
+    draw(aggregate(cube), ax)
+    fig.tight_layout()
     plt.show()
 
 
-def plot_laps_led_by_constructor(df):
+def plot_median_pitstop_duration_by_team(df, cube=None):
+    """
+    Chart of the average pit-stop duration per team with the fastest team highlighted.
+    """
+    show_chart("median_pitstop_duration_by_team", df, cube)
+
+
+def plot_average_pitstops_per_race(df, cube=None):
+    """
+    Chart of the average pit stops per race with the race with the fewest average pit stops highlighted.
+    """
+    show_chart("average_pitstops_per_race", df, cube)
+
+
+def plot_average_pitstop_duration_by_season(df, cube=None):
+    """
+    Chart of the average pit-stop duration per season.
+    """
+    show_chart("average_pitstop_duration_by_season", df, cube)
+
+
+def plot_average_pitstops_by_season(df, cube=None):
+    """
+    Chart of the average number of pit stops per race per season.
+    """
+    show_chart("average_pitstops_by_season", df, cube)
+
+
+def plot_points_by_drivers(df, cube=None):
+    """
+    Chart of the accumulated points by the top 10 drivers.
+    """
+    show_chart("points_by_drivers", df, cube)
+
+
+def plot_laps_led_by_constructor(df, cube=None):
     """
     This function takes a Formula 1 DataFrame and generates a bar chart depicting the total number of laps led by each constructor.
     """
-    df["Laps"] = pd.to_numeric(df["Laps"], errors="coerce")
-    df["Laps"].fillna(0, inplace=True)
-    laps_led_by_constructor = (
-        df.groupby("Constructor")["Laps"].sum().sort_values(ascending=False)
-    )
-
-    plt.figure(figsize=(14, 7))
-    plt.bar(laps_led_by_constructor.index, laps_led_by_constructor.values, color="navy")
-    plt.title("Total de Vueltas Lideradas por Constructor")
-    plt.xlabel("Constructor")
-    plt.ylabel("Vueltas Lideradas")
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    plt.show()
+    show_chart("laps_led_by_constructor", df, cube)
+
+
+def render_chart(name, aggregate, path):
+    """
+    Function that draws a chart on an Agg canvas, without any window, and saves it to a file.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    _, draw, figsize = CHARTS[name]
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    draw(aggregate, fig.add_subplot())
+    fig.tight_layout()
+    fig.savefig(path)
+    return path
+
+
+def render_charts(df, output_path="figures", format="png", max_workers=None):
+    """
+    Function that saves every chart of the report to output_path, drawing them in parallel processes.
+    Only the small aggregates of the cube are sent to the processes, not the dataframe.
+    """
+    os.makedirs(output_path, exist_ok=True)
+    metricas = obtener_metricas()
+    with metricas.stage("plot.cube"):
+        cube = AggregateCube(df)
+        tareas = [
+            (name, aggregate(cube), os.path.join(output_path, f"{name}.{format}"))
+            for name, (aggregate, _, _) in CHARTS.items()
+        ]
+
+    with metricas.stage("plot.render"):
+        # With a single worker the charts are drawn in this process, without starting any other
+        if max_workers == 1:
+            return [render_chart(*tarea) for tarea in tareas]
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(render_chart, *zip(*tareas)))
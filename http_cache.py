@@ -0,0 +1,225 @@
+"""
+http_cache.py
+
+Adquisición de datos - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Integrantes del grupo:
+    - Lydia Ruiz
+    - David Tarrasa
+    - Jorge Vančo
+    - Alberto Velasco
+
+Descripción:
+Caché persistente en disco de las respuestas HTTP de Ergast y Wikipedia, compartida por ergast_pitstops_data.py y formula1_spider.py"""
+
+import datetime
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+
+# Pages of a season fetched after the end of the season never change, so they never expire.
+patron_temporada = re.compile(r"(?<!\d)(19[5-9]\d|20\d\d)(?=[/_])")
+
+# Time to live (seconds) of the pages that may still change, by URL pattern.
+TTLS_POR_DEFECTO = [
+    (re.compile(r"/drivers/\w+\.json"), 30 * 24 * 3600),
+    (re.compile(r"wikipedia\.org"), 24 * 3600),
+    (re.compile(r"ergast\.com"), 3600),
+]
+TTL_POR_DEFECTO = 3600
+
+
+class CachedResponse:
+    """
+    Class that stores the body and validators of a cached response.
+    """
+
+    def __init__(self, url, body, etag, last_modified, fresh):
+        self.url = url
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fresh = fresh
+
+    def conditional_headers(self):
+        """
+        Method that returns the headers needed to revalidate the response with the server.
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """
+    Class that implements an on-disk HTTP response cache keyed by URL.
+
+    Bodies are stored once under the SHA-256 of their content and an SQLite index maps
+    every URL to its body, validators and last access, which is used for LRU eviction.
+    """
+
+    def __init__(
+        self, path="cache/http", max_size=512 * 1024**2, ttls=None, default_ttl=None
+    ):
+        self.path = path
+        self.blobs_path = os.path.join(path, "blobs")
+        self.max_size = max_size
+        self.ttls = TTLS_POR_DEFECTO if ttls is None else ttls
+        self.default_ttl = TTL_POR_DEFECTO if default_ttl is None else default_ttl
+        self.stats = {"hits": 0, "misses": 0, "revalidated": 0, "evicted": 0}
+        self.lock = threading.Lock()
+
+        os.makedirs(self.blobs_path, exist_ok=True)
+        self.db = sqlite3.connect(
+            os.path.join(path, "index.sqlite"), check_same_thread=False
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "url TEXT PRIMARY KEY, digest TEXT, size INTEGER, etag TEXT, "
+            "last_modified TEXT, fetched_at REAL, last_access REAL)"
+        )
+        self.db.commit()
+
+    def ttl(self, url, fetched_at=None):
+        """
+        Method that returns the time to live of a URL fetched at some time, or None if it never expires.
+        A page of a season only stops expiring if it was fetched after the season ended.
+        """
+        busqueda = re.search(patron_temporada, url)
+        if busqueda != None and fetched_at is not None:
+            fin_temporada = datetime.datetime(int(busqueda.group(1)) + 1, 1, 1)
+            if fetched_at >= fin_temporada.timestamp():
+                return None
+        for patron, ttl in self.ttls:
+            if re.search(patron, url):
+                return ttl
+        return self.default_ttl
+
+    def blob_path(self, digest):
+        """
+        Method that returns the path of the file that stores a body.
+        """
+        return os.path.join(self.blobs_path, digest[:2], digest)
+
+    def get(self, url):
+        """
+        Method that returns the cached response of a URL (fresh or stale), or None.
+        """
+        with self.lock:
+            fila = self.db.execute(
+                "SELECT digest, etag, last_modified, fetched_at FROM responses "
+                "WHERE url = ?",
+                (url,),
+            ).fetchone()
+            if fila == None:
+                self.stats["misses"] += 1
+                return None
+            digest, etag, last_modified, fetched_at = fila
+            try:
+                with open(self.blob_path(digest), "rb") as f:
+                    body = f.read()
+            except FileNotFoundError:
+                self.db.execute("DELETE FROM responses WHERE url = ?", (url,))
+                self.db.commit()
+                self.stats["misses"] += 1
+                return None
+
+            ttl = self.ttl(url, fetched_at)
+            fresh = ttl is None or time.time() - fetched_at < ttl
+            self.stats["hits" if fresh else "misses"] += 1
+            self.db.execute(
+                "UPDATE responses SET last_access = ? WHERE url = ?", (time.time(), url)
+            )
+            self.db.commit()
+        return CachedResponse(url, body, etag, last_modified, fresh)
+
+    def put(self, url, body, etag=None, last_modified=None):
+        """
+        Method that stores the response of a URL and evicts old entries if the cache is too big.
+        """
+        digest = hashlib.sha256(body).hexdigest()
+        path = self.blob_path(digest)
+        with self.lock:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path + ".tmp", "wb") as f:
+                    f.write(body)
+                os.replace(path + ".tmp", path)
+            ahora = time.time()
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, digest, len(body), etag, last_modified, ahora, ahora),
+            )
+            self.db.commit()
+            self.evict()
+
+    def refresh(self, url):
+        """
+        Method that marks a cached response as fresh after the server answered 304 Not Modified.
+        """
+        with self.lock:
+            self.db.execute(
+                "UPDATE responses SET fetched_at = ? WHERE url = ?", (time.time(), url)
+            )
+            self.db.commit()
+            self.stats["revalidated"] += 1
+
+    def size(self):
+        """
+        Method that returns the number of bytes taken by the stored bodies.
+        """
+        return self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM "
+            "(SELECT DISTINCT digest, size FROM responses)"
+        ).fetchone()[0]
+
+    def evict(self):
+        """
+        Method that removes the least recently used responses until the size limit is respected.
+        """
+        total = self.size()
+        if total <= self.max_size:
+            return
+        filas = self.db.execute(
+            "SELECT url, digest, size FROM responses ORDER BY last_access"
+        ).fetchall()
+        for url, digest, size in filas:
+            if total <= self.max_size:
+                break
+            self.db.execute("DELETE FROM responses WHERE url = ?", (url,))
+            self.stats["evicted"] += 1
+
+            # Bodies are shared between URLs with the same content
+            usado = self.db.execute(
+                "SELECT 1 FROM responses WHERE digest = ? LIMIT 1", (digest,)
+            ).fetchone()
+            if usado == None:
+                try:
+                    os.remove(self.blob_path(digest))
+                except FileNotFoundError:
+                    pass
+                total -= size
+        self.db.commit()
+
+
+cache_respuestas = None
+lock_cache = threading.Lock()
+
+
+def obtener_cache():
+    """
+    Function that returns the response cache shared by every module of the project.
+    """
+    global cache_respuestas
+    with lock_cache:
+        if cache_respuestas is None:
+            cache_respuestas = ResponseCache()
+    return cache_respuestas
@@ -0,0 +1,260 @@
+"""
+lap_store.py
+
+Adquisición de datos - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Integrantes del grupo:
+    - Lydia Ruiz
+    - David Tarrasa
+    - Jorge Vančo
+    - Alberto Velasco
+
+Descripción:
+Almacén compacto en arrays de NumPy de los tiempos por vuelta de Ergast (vuelta int16, milisegundos int32 y pilotos
+codificados con diccionario), que se puede cruzar con los pit-stops por (Season, RaceNumber, driverId)"""
+
+import os
+import numpy as np
+import pandas as pd
+from surrogate_keys import race_keys
+
+
+laps_path = os.path.join("cache", "laps")
+
+# Columns of the store and their types. driverId holds the code of the driver in the dictionary of the store.
+LAP_DTYPES = {
+    "Season": np.int16,
+    "RaceNumber": np.int16,
+    "driverId": np.int32,
+    "Lap": np.int16,
+    "Position": np.int16,
+    "Milliseconds": np.int32,
+}
+
+# Columns that identify the driver of a race, shared with the processed pitstops.
+JOIN_COLUMNS = ["Season", "RaceNumber", "driverId"]
+
+patron_tiempo = r"^(?:(\d+):)?(\d+(?:\.\d+)?)$"
+
+
+def lap_times_to_ms(tiempos) -> np.ndarray:
+    """
+    Function that converts lap times such as 1:37.284 to milliseconds (int32), -1 if the time is missing.
+    """
+    partes = pd.Series(tiempos, dtype="string").str.extract(patron_tiempo)
+    minutos = pd.to_numeric(partes[0]).fillna(0)
+    segundos = minutos * 60 + pd.to_numeric(partes[1])
+    return (segundos * 1000).round().fillna(-1).to_numpy(np.int32)
+
+
+def season_path(season, path=laps_path):
+    """
+    Function that returns the file of the lap store of a season.
+    """
+    return os.path.join(path, f"laps_{season}.npz")
+
+
+def driver_keys(seasons, race_numbers, codes) -> np.ndarray:
+    """
+    Function that returns an int64 key for every (Season, RaceNumber, driver code).
+    """
+    return (
+        (np.asarray(seasons, dtype=np.int64) << 48)
+        | (np.asarray(race_numbers, dtype=np.int64) << 32)
+        | (np.asarray(codes, dtype=np.int64) & 0xFFFFFFFF)
+    )
+
+
+class LapStore:
+    """
+    Class that keeps lap timings as one NumPy array per column (16 bytes per lap).
+    Drivers are stored as int32 codes of a sorted dictionary of driverIds, so the strings are kept once.
+    """
+
+    def __init__(self, columns, drivers):
+        self.columns = {
+            col: np.asarray(columns[col], dtype=dtype)
+            for col, dtype in LAP_DTYPES.items()
+        }
+        self.drivers = np.asarray(drivers, dtype=str)
+
+    @classmethod
+    def from_batches(cls, lotes):
+        """
+        Method that builds the store from batches {column: array} whose driverId column holds the driverIds.
+        """
+        lotes = list(lotes)
+        if not lotes:
+            return cls.empty()
+        columnas = {
+            col: np.concatenate([lote[col] for lote in lotes]) for col in LAP_DTYPES
+        }
+        drivers, codigos = np.unique(
+            columnas["driverId"].astype(str), return_inverse=True
+        )
+        columnas["driverId"] = codigos
+        return cls(columnas, drivers)
+
+    @classmethod
+    def empty(cls):
+        """
+        Method that returns a store without laps.
+        """
+        return cls({col: [] for col in LAP_DTYPES}, [])
+
+    @classmethod
+    def concat(cls, stores):
+        """
+        Method that joins several stores, merging their dictionaries of drivers.
+        """
+        stores = list(stores)
+        if not stores:
+            return cls.empty()
+        drivers = stores[0].drivers
+        for store in stores[1:]:
+            drivers = np.union1d(drivers, store.drivers)
+        columnas = {col: [] for col in LAP_DTYPES}
+        for store in stores:
+            # The dictionaries are sorted, so the new code of every driver is a binary search
+            recodificar = np.searchsorted(drivers, store.drivers).astype(np.int32)
+            for col in LAP_DTYPES:
+                valores = store.columns[col]
+                if col == "driverId":
+                    valores = recodificar[valores]
+                columnas[col].append(valores)
+        return cls(
+            {col: np.concatenate(valores) for col, valores in columnas.items()}, drivers
+        )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Method that reads a store saved with save.
+        """
+        with np.load(path) as datos:
+            return cls({col: datos[col] for col in LAP_DTYPES}, datos["drivers"])
+
+    def save(self, path):
+        """
+        Method that saves the store to an .npz file, replacing the previous file at once.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path + ".tmp", "wb") as fich:
+            np.savez(fich, drivers=self.drivers, **self.columns)
+        os.replace(path + ".tmp", path)
+
+    def __len__(self):
+        return len(self.columns["Lap"])
+
+    @property
+    def nbytes(self):
+        """
+        Memory used by the arrays of the store, in bytes.
+        """
+        arrays = list(self.columns.values()) + [self.drivers]
+        return sum(valores.nbytes for valores in arrays)
+
+    def races(self):
+        """
+        Method that returns the (Season, RaceNumber) races of the store.
+        """
+        claves = np.unique(self.race_keys())
+        return [tuple(int(parte) for parte in divmod(clave, 100)) for clave in claves]
+
+    def race_keys(self):
+        """
+        Method that returns the race key (surrogate_keys.race_keys) of every lap.
+        """
+        return race_keys(self.columns["Season"], self.columns["RaceNumber"])
+
+    def select(self, mascara):
+        """
+        Method that returns a store with the laps of a boolean mask (the dictionary is shared).
+        """
+        return LapStore(
+            {col: valores[mascara] for col, valores in self.columns.items()},
+            self.drivers,
+        )
+
+    def race(self, season, race_number):
+        """
+        Method that returns the laps of a race.
+        """
+        return self.select(
+            (self.columns["Season"] == season)
+            & (self.columns["RaceNumber"] == race_number)
+        )
+
+    def driver_codes(self, driver_ids) -> np.ndarray:
+        """
+        Method that returns the codes of some driverIds in the dictionary, -1 for unknown drivers.
+        """
+        driver_ids = np.asarray(driver_ids, dtype=str)
+        if not len(self.drivers):
+            return np.full(len(driver_ids), -1, dtype=np.int32)
+        posiciones = np.searchsorted(self.drivers, driver_ids)
+        posiciones = np.minimum(posiciones, len(self.drivers) - 1)
+        return np.where(self.drivers[posiciones] == driver_ids, posiciones, -1).astype(
+            np.int32
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Method that returns the laps as a DataFrame. driverId is a categorical over the dictionary of the store.
+        """
+        df = pd.DataFrame(self.columns, copy=False)
+        df["driverId"] = pd.Categorical.from_codes(
+            self.columns["driverId"], categories=self.drivers
+        )
+        return df
+
+    def join(self, df, columns=None) -> pd.DataFrame:
+        """
+        Method that returns the laps with the columns of a DataFrame with one row per (Season, RaceNumber, driverId),
+        such as the processed pitstops. Laps of drivers that are not in the DataFrame get missing values.
+        """
+        columns = [col for col in (columns or df.columns) if col not in JOIN_COLUMNS]
+        codigos = self.driver_codes(df["driverId"].astype(str))
+        # Rows of drivers without laps in the store (code -1) cannot match any lap, and would repeat keys
+        filas = np.flatnonzero(codigos >= 0)
+        claves = driver_keys(
+            pd.to_numeric(df["Season"]).to_numpy()[filas],
+            pd.to_numeric(df["RaceNumber"]).to_numpy()[filas],
+            codigos[filas],
+        )
+        indices = pd.Index(claves).get_indexer(
+            driver_keys(
+                self.columns["Season"],
+                self.columns["RaceNumber"],
+                self.columns["driverId"],
+            )
+        )
+        # filas gets a final -1, so the laps without a driver in df (index -1) get position -1
+        posiciones = np.append(filas, -1)[indices]
+        resultado = self.to_frame()
+        # Position -1 (driver not found) becomes a missing value
+        for col in columns:
+            resultado[col] = pd.api.extensions.take(
+                df[col].array, posiciones, allow_fill=True
+            )
+        return resultado
+
+
+def load_lap_store(seasons=None, path=laps_path) -> LapStore:
+    """
+    Function that loads the lap stores of some seasons (all the saved seasons by default) into a single store.
+    """
+    if seasons is None:
+        if not os.path.exists(path):
+            return LapStore.empty()
+        seasons = sorted(
+            int(nombre[5:-4])
+            for nombre in os.listdir(path)
+            if nombre.startswith("laps_") and nombre.endswith(".npz")
+        )
+    return LapStore.concat(
+        LapStore.load(season_path(season, path))
+        for season in seasons
+        if os.path.exists(season_path(season, path))
+    )
@@ -11,24 +11,401 @@ Integrantes del grupo:
     - Alberto Velasco
 
 Descripción:
-Obtención de un dataset que permite extraer conclusiones sobre la influencia de los pit-stops en los resultados y otros parámetros del campeonato mundial de la Formula 1"""
+Obtención de un dataset que permite extraer conclusiones sobre la influencia de los pit-stops en los resultados y otros parámetros del campeonato mundial de la Formula 1
 
-from dataframe import create_df
-from formula1_spider import setup_crawler
-from ergast_pitstops_data import crear_csv_dataframes_intervalos
+Uso: python main.py [all|crawl|fetch-pitstops|fetch-laps|merge|update|plot|simulate] [--seasons 2012-2023] ..."""
 
-anno_inicial = 2012
-anno_final = 2023
+import argparse
+import sys
 
+# Seasons processed when no --seasons option is given.
+TEMPORADAS_POR_DEFECTO = "2012-2023"
 
-if __name__ == "__main__":
-    # Get contents from wikipedia using Scrapy
-    process = setup_crawler()
+
+def parse_seasons(texto):
+    """
+    Function that converts a season range such as 2012-2023, or a single season such as 2019, to (first, last).
+    """
+    inicio, _, fin = texto.partition("-")
+    try:
+        anno_inicial, anno_final = int(inicio), int(fin or inicio)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid season range: {texto}")
+    if anno_inicial > anno_final:
+        raise argparse.ArgumentTypeError(f"invalid season range: {texto}")
+    return anno_inicial, anno_final
+
+
+def parse_non_negative(texto):
+    """
+    Function that converts a number of pit stops to an int, rejecting negative numbers.
+    """
+    try:
+        numero = int(texto)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid number: {texto}")
+    if numero < 0:
+        raise argparse.ArgumentTypeError(f"must be 0 or more: {texto}")
+    return numero
+
+
+def parse_positive(texto):
+    """
+    Function that converts a number of trials to an int, rejecting numbers lower than 1.
+    """
+    try:
+        numero = int(texto)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid number: {texto}")
+    if numero < 1:
+        raise argparse.ArgumentTypeError(f"must be 1 or more: {texto}")
+    return numero
+
+
+def crawl(args):
+    """
+    Function that gets the race results from Wikipedia using Scrapy.
+    """
+    from formula1_spider import setup_crawler
+
+    anno_inicial, anno_final = args.seasons
+    process = setup_crawler(
+        range(anno_inicial, anno_final + 1),
+        concurrency=args.concurrency,
+        store_format=args.store_format,
+    )
     process.start()
 
-    # Get data from Ergast F1 Ap
-    crear_csv_dataframes_intervalos(anno_inicial, anno_final)
 
-    # Create dataframe by merging data
-    df = create_df()
+def fetch_pitstops(args):
+    """
+    Function that gets the pit stops from the Ergast F1 API and processes them.
+    """
+    from ergast_pitstops_data import crear_csv_dataframes_intervalos
+
+    anno_inicial, anno_final = args.seasons
+    crear_csv_dataframes_intervalos(
+        anno_inicial,
+        anno_final,
+        update=args.update,
+        max_workers=args.workers,
+        peticiones_por_segundo=args.rate,
+        procesos=args.processes,
+        memoria_maxima=args.memory_budget and args.memory_budget * 1024 * 1024,
+        guardar_crudos=args.keep_raw,
+    )
+
+
+def fetch_laps(args):
+    """
+    Function that gets the lap timings from the Ergast F1 API into the lap store.
+    """
+    from ergast_pitstops_data import crear_vueltas_intervalo
+
+    anno_inicial, anno_final = args.seasons
+    almacen = crear_vueltas_intervalo(
+        anno_inicial,
+        anno_final,
+        update=args.update,
+        max_workers=args.workers,
+        peticiones_por_segundo=args.rate,
+    )
+    print(f"Laps: {len(almacen)} ({almacen.nbytes / 1024**2:.1f} MB)")
+
+
+def merge(args):
+    """
+    Function that creates the merged dataframe from the data already downloaded.
+    """
+    from dataframe import create_df
+
+    df = create_df(format=args.format, store_format=args.store_format)
+    print(df)
+
+
+def update(args):
+    """
+    Function that downloads and merges only the new or changed races.
+    """
+    from pipeline_incremental import run_incremental
+    from http_cache import obtener_cache
+
+    anno_inicial, anno_final = args.seasons
+    df, units = run_incremental(
+        anno_inicial, anno_final, format=args.format, store_format=args.store_format
+    )
+    print(f"Races updated: {len(units)}")
     print(df)
+    print("HTTP cache:", obtener_cache().stats)
+
+
+def plot(args):
+    """
+    Function that draws the charts of the report from the merged dataframe.
+    """
+    import graphs
+
+    df = graphs.load_graph_df(format=args.format)
+    if args.show:
+        cube = graphs.AggregateCube(df)
+        for name in graphs.CHARTS:
+            graphs.show_chart(name, df, cube)
+        return
+    for path in graphs.render_charts(
+        df, args.output, args.image_format, max_workers=args.workers
+    ):
+        print(path)
+
+
+def simulate(args):
+    """
+    Function that simulates the pit-stop strategies of every team at a circuit with the merged dataframe.
+    """
+    import pandas as pd
+    from strategy_simulator import load_simulation_df, simulate_strategies
+
+    df = load_simulation_df(format=args.format)
+    resultados = simulate_strategies(
+        df,
+        args.circuit,
+        season=args.season,
+        stops=args.stops,
+        trials=args.trials,
+        seed=args.seed,
+        max_workers=args.processes,
+    )
+    with pd.option_context("display.max_rows", None, "display.width", None):
+        print(
+            resultados.sort_values(["ExpectedPosition", "Stops"]).to_string(index=False)
+        )
+
+
+def run_all(args):
+    """
+    Function that runs the whole pipeline: Wikipedia, Ergast and merged dataframe.
+    """
+    from http_cache import obtener_cache
+    from metrics import obtener_metricas
+
+    metricas = obtener_metricas()
+    with metricas.stage("crawl"):
+        crawl(args)
+    with metricas.stage("fetch-pitstops"):
+        fetch_pitstops(args)
+    with metricas.stage("merge"):
+        merge(args)
+    print("HTTP cache:", obtener_cache().stats)
+
+
+def build_parser():
+    """
+    Function that builds the parser of the command line, one subcommand per stage.
+    """
+    parser = argparse.ArgumentParser(
+        description="Formula 1 results and pit-stops dataset"
+    )
+    subparsers = parser.add_subparsers(dest="command")
+
+    seasons = argparse.ArgumentParser(add_help=False)
+    seasons.add_argument(
+        "--seasons",
+        type=parse_seasons,
+        default=parse_seasons(TEMPORADAS_POR_DEFECTO),
+        help=f"season or range of seasons, e.g. 2019 or 2012-2023 (default {TEMPORADAS_POR_DEFECTO})",
+    )
+
+    formats = argparse.ArgumentParser(add_help=False)
+    formats.add_argument(
+        "--format",
+        choices=["csv", "parquet", "arrow", "snapshot"],
+        default="csv",
+        help="format of the merged dataframe (snapshot: memory-mapped by the readers)",
+    )
+
+    instrumentation = argparse.ArgumentParser(add_help=False)
+    instrumentation.add_argument(
+        "--metrics", metavar="PATH", help="write the stages and counters to a JSON file"
+    )
+    instrumentation.add_argument(
+        "--trace", metavar="PATH", help="write the stages to a Chrome trace file"
+    )
+    instrumentation.add_argument(
+        "--profile",
+        metavar="STAGE",
+        action="append",
+        default=[],
+        help="run a stage (e.g. ergast.aggregate) under cProfile, can be repeated",
+    )
+    instrumentation.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="measure the peak Python memory of every stage of the main thread (slower)",
+    )
+
+    store_formats = argparse.ArgumentParser(add_help=False)
+    store_formats.add_argument(
+        "--store-format",
+        choices=["csv", "parquet", "arrow"],
+        default="csv",
+        help="format of the store of the Wikipedia results",
+    )
+
+    crawl_options = argparse.ArgumentParser(add_help=False)
+    crawl_options.add_argument(
+        "--concurrency", type=int, default=8, help="concurrent requests of the crawl"
+    )
+
+    download_options = argparse.ArgumentParser(add_help=False)
+    download_options.add_argument(
+        "--workers", type=int, default=8, help="concurrent downloads from Ergast"
+    )
+    download_options.add_argument(
+        "--rate", type=float, default=None, help="maximum requests per second"
+    )
+    download_options.add_argument(
+        "--update", action="store_true", help="download the races again"
+    )
+
+    fetch_options = argparse.ArgumentParser(add_help=False)
+    fetch_options.add_argument(
+        "--keep-raw",
+        action="store_true",
+        help="also save the raw pitstops of every race to cache/<season>",
+    )
+    fetch_options.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="process the seasons in parallel in this many processes",
+    )
+    fetch_options.add_argument(
+        "--memory-budget",
+        type=int,
+        default=None,
+        metavar="MB",
+        help="raw pitstops downloaded and waiting to be processed (with --processes)",
+    )
+
+    subparsers.add_parser(
+        "all",
+        parents=[
+            seasons,
+            formats,
+            store_formats,
+            crawl_options,
+            download_options,
+            fetch_options,
+            instrumentation,
+        ],
+        help="crawl, fetch the pit stops and merge (default)",
+    ).set_defaults(func=run_all)
+    subparsers.add_parser(
+        "crawl",
+        parents=[seasons, store_formats, crawl_options, instrumentation],
+        help="get the race results from Wikipedia",
+    ).set_defaults(func=crawl)
+    subparsers.add_parser(
+        "fetch-pitstops",
+        parents=[seasons, download_options, fetch_options, instrumentation],
+        help="get the pit stops from the Ergast F1 API",
+    ).set_defaults(func=fetch_pitstops)
+    subparsers.add_parser(
+        "fetch-laps",
+        parents=[seasons, download_options, instrumentation],
+        help="get the lap timings from the Ergast F1 API",
+    ).set_defaults(func=fetch_laps)
+    subparsers.add_parser(
+        "merge",
+        parents=[formats, store_formats, instrumentation],
+        help="merge the downloaded data into the dataframe",
+    ).set_defaults(func=merge)
+    subparsers.add_parser(
+        "update",
+        parents=[seasons, formats, store_formats, instrumentation],
+        help="download and merge only the new or changed races",
+    ).set_defaults(func=update)
+
+    plot_parser = subparsers.add_parser(
+        "plot", parents=[formats, instrumentation], help="draw the charts of the report"
+    )
+    plot_parser.add_argument(
+        "--output", default="figures", help="directory of the images"
+    )
+    plot_parser.add_argument(
+        "--image-format", default="png", help="format of the images (png, svg, pdf)"
+    )
+    plot_parser.add_argument(
+        "--workers", type=int, default=None, help="processes drawing the charts"
+    )
+    plot_parser.add_argument(
+        "--show", action="store_true", help="show the charts in windows instead"
+    )
+    plot_parser.set_defaults(func=plot)
+
+    simulate_parser = subparsers.add_parser(
+        "simulate",
+        parents=[formats, instrumentation],
+        help="simulate the pit-stop strategies of every team at a circuit",
+    )
+    simulate_parser.add_argument(
+        "--circuit", required=True, help="race name, e.g. 'Bahrain Grand Prix'"
+    )
+    simulate_parser.add_argument(
+        "--season",
+        type=int,
+        default=None,
+        help="season of the race whose teams are simulated (default the latest one)",
+    )
+    simulate_parser.add_argument(
+        "--stops",
+        type=parse_non_negative,
+        nargs="+",
+        default=[1, 2, 3],
+        help="numbers of stops tried by every team (default 1 2 3)",
+    )
+    simulate_parser.add_argument(
+        "--trials",
+        type=parse_positive,
+        default=100_000,
+        help="races simulated (default 100000)",
+    )
+    simulate_parser.add_argument(
+        "--seed", type=int, default=0, help="seed of the random numbers"
+    )
+    simulate_parser.add_argument(
+        "--processes", type=int, default=None, help="processes running the trials"
+    )
+    simulate_parser.set_defaults(func=simulate)
+
+    return parser
+
+
+def main(argv=None):
+    """
+    Function that runs the subcommand of the command line.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    # Without a subcommand the whole pipeline is run, as before
+    if not argv or argv[0].startswith("-") and argv[0] not in ("-h", "--help"):
+        argv = ["all"] + argv
+    args = build_parser().parse_args(argv)
+
+    from metrics import obtener_metricas
+
+    metricas = obtener_metricas()
+    metricas.profile(*args.profile)
+    if args.trace_memory:
+        metricas.trace_memory()
+    with metricas.stage(args.command):
+        args.func(args)
+
+    if args.metrics:
+        metricas.to_json(args.metrics)
+    if args.trace:
+        metricas.to_chrome_trace(args.trace)
+    if args.metrics or args.trace or args.profile:
+        print(metricas.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+metrics.py
+
+Adquisición de datos - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Integrantes del grupo:
+    - Lydia Ruiz
+    - David Tarrasa
+    - Jorge Vančo
+    - Alberto Velasco
+
+Descripción:
+Medición del tiempo, la memoria y los contadores (peticiones HTTP, bytes, aciertos de caché, filas) de cada etapa del proyecto"""
+
+import cProfile
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # resource only exists on Unix
+    resource = None
+
+
+def peak_rss():
+    """
+    Function that returns the highest resident memory of the process so far, in bytes, or None.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is given in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Metrics:
+    """
+    Class that records the stages of a run (name, labels such as season and race, duration and memory)
+    and the counters of the run. Stages can be nested and recorded from several threads.
+    tracemalloc only has one peak for the whole process, so peak_python is only measured for the stages
+    of the main thread, and includes the memory allocated meanwhile by the threads they start.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.stages = []
+        self.counters = {}
+        self.profile_stages = set()
+        self.profile_path = os.path.join("cache", "profiles")
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        # Only one profiler can be active in the process (Python 3.12 refuses a second one)
+        self.profile_lock = threading.Lock()
+
+    def count(self, name, value=1):
+        """
+        Method that adds a value to a counter.
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def trace_memory(self):
+        """
+        Method that starts measuring the peak Python memory of every stage (slower).
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def profile(self, *names):
+        """
+        Method that runs the stages with the given names under cProfile, saving one .prof file per stage.
+        A stage that starts while another one is being profiled (e.g. in another thread) is not profiled.
+        """
+        self.profile_stages.update(names)
+
+    @contextmanager
+    def stage(self, name, **labels):
+        """
+        Method (context manager) that records the duration and memory of a stage.
+        """
+        pila = self.local.__dict__.setdefault("stack", [])
+        registro = {"name": name, "labels": labels, "thread": threading.get_ident()}
+        hilo_principal = threading.current_thread() is threading.main_thread()
+        if tracemalloc.is_tracing() and hilo_principal:
+            # The peak is reset for the new stage, so the enclosing stage keeps the peak reached so far
+            if pila and "children_peak" in pila[-1]:
+                pila[-1]["children_peak"] = max(
+                    pila[-1]["children_peak"], tracemalloc.get_traced_memory()[1]
+                )
+            registro["children_peak"] = 0
+            tracemalloc.reset_peak()
+        pila.append(registro)
+
+        perfil = None
+        if name in self.profile_stages and self.profile_lock.acquire(blocking=False):
+            perfil = cProfile.Profile()
+            try:
+                perfil.enable()
+            except ValueError:
+                # Another profiling tool is already active
+                self.profile_lock.release()
+                perfil = None
+
+        inicio = time.perf_counter()
+        try:
+            yield registro
+        finally:
+            fin = time.perf_counter()
+            if perfil is not None:
+                perfil.disable()
+                self.profile_lock.release()
+                self.dump_profile(perfil, name, labels)
+
+            pila.pop()
+            registro["start"] = inicio - self.origin
+            registro["duration"] = fin - inicio
+            registro["peak_rss"] = peak_rss()
+            if "children_peak" in registro:
+                pico = max(
+                    tracemalloc.get_traced_memory()[1], registro["children_peak"]
+                )
+                registro["peak_python"] = pico
+                del registro["children_peak"]
+                if pila and "children_peak" in pila[-1]:
+                    pila[-1]["children_peak"] = max(pila[-1]["children_peak"], pico)
+            with self.lock:
+                self.stages.append(registro)
+
+    def dump_profile(self, perfil, name, labels):
+        """
+        Method that saves the cProfile statistics of a stage (open them with pstats or snakeviz).
+        """
+        os.makedirs(self.profile_path, exist_ok=True)
+        sufijo = "".join(f"_{valor}" for valor in labels.values())
+        perfil.dump_stats(os.path.join(self.profile_path, f"{name}{sufijo}.prof"))
+
+    def summary(self):
+        """
+        Method that returns, for every stage name, the number of times it ran and its total and maximum duration.
+        """
+        resumen = {}
+        with self.lock:
+            for registro in self.stages:
+                datos = resumen.setdefault(
+                    registro["name"], {"count": 0, "total": 0.0, "max": 0.0}
+                )
+                datos["count"] += 1
+                datos["total"] += registro["duration"]
+                datos["max"] = max(datos["max"], registro["duration"])
+        return resumen
+
+    def to_json(self, path):
+        """
+        Method that writes the stages, their summary and the counters to a JSON file.
+        """
+        with self.lock:
+            contenido = {
+                "stages": sorted(self.stages, key=lambda registro: registro["start"]),
+                "counters": dict(self.counters),
+            }
+        contenido["summary"] = self.summary()
+        with open(path, "w", encoding="utf-8") as fich:
+            json.dump(contenido, fich, indent=4, default=str)
+
+    def to_chrome_trace(self, path):
+        """
+        Method that writes the stages as a Chrome trace file (chrome://tracing or https://ui.perfetto.dev).
+        """
+        pid = os.getpid()
+        with self.lock:
+            eventos = [
+                {
+                    "name": registro["name"],
+                    "ph": "X",
+                    "ts": registro["start"] * 1e6,
+                    "dur": registro["duration"] * 1e6,
+                    "pid": pid,
+                    "tid": registro["thread"],
+                    "args": {
+                        **registro["labels"],
+                        **{
+                            clave: registro[clave]
+                            for clave in ("peak_rss", "peak_python")
+                            if clave in registro
+                        },
+                    },
+                }
+                for registro in self.stages
+            ]
+            final = max([evento["ts"] + evento["dur"] for evento in eventos], default=0)
+            eventos += [
+                {
+                    "name": nombre,
+                    "ph": "C",
+                    "ts": final,
+                    "pid": pid,
+                    "args": {nombre: valor},
+                }
+                for nombre, valor in self.counters.items()
+            ]
+        with open(path, "w", encoding="utf-8") as fich:
+            json.dump(
+                {"traceEvents": eventos, "displayTimeUnit": "ms"}, fich, default=str
+            )
+
+    def report(self):
+        """
+        Method that returns a text table with the summary of the stages and the counters.
+        """
+        lineas = [f"{'stage':<32} {'count':>6} {'total (s)':>10} {'max (s)':>10}"]
+        for nombre, datos in sorted(
+            self.summary().items(), key=lambda item: -item[1]["total"]
+        ):
+            lineas.append(
+                f"{nombre:<32} {datos['count']:>6} {datos['total']:>10.3f} {datos['max']:>10.3f}"
+            )
+        for nombre, valor in sorted(self.counters.items()):
+            lineas.append(f"{nombre:<32} {valor:>6}")
+        return "\n".join(lineas)
+
+
+metricas = None
+lock_metricas = threading.Lock()
+
+
+def obtener_metricas():
+    """
+    Function that returns the metrics shared by every module of the project.
+    """
+    global metricas
+    with lock_metricas:
+        if metricas is None:
+            metricas = Metrics()
+    return metricas
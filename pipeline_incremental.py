@@ -0,0 +1,186 @@
+"""
+pipeline_incremental.py
+
+Adquisición de datos - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Integrantes del grupo:
+    - Lydia Ruiz
+    - David Tarrasa
+    - Jorge Vančo
+    - Alberto Velasco
+
+Descripción:
+Ejecución incremental del proceso: solo se descargan, procesan y cruzan las carreras nuevas o cuyo contenido ha cambiado"""
+
+import datetime
+import hashlib
+import json
+import os
+import re
+import pandas as pd
+from dataframe import (
+    cache_path,
+    load_df,
+    procesado_path,
+    spider_store_path,
+    update_df,
+)
+from storage import dataset_path, get_storage
+
+
+manifest_path = os.path.join(cache_path, "manifest.json")
+patron_procesado = re.compile(r"pitstops_(\d+)_(\d+)\.csv$")
+
+
+class Manifest:
+    """
+    Class that keeps track of the processed races and the content hash of the data they come from.
+    """
+
+    def __init__(self, path=manifest_path, store_format="csv"):
+        self.path = path
+        self.store_format = store_format
+        self.units = {}
+        self.seasons_done = []
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as fich:
+                contenido = json.load(fich)
+            # Manifests written before the results store, or for a store in another format, are discarded
+            if contenido.get("store_format") == store_format:
+                self.units = contenido["units"]
+                self.seasons_done = contenido["seasons_done"]
+
+    def pending_seasons(self, anno_inicial, anno_final):
+        """
+        Method that returns the seasons that may still have new or changed races.
+        """
+        return [
+            anno
+            for anno in range(anno_inicial, anno_final + 1)
+            if anno not in self.seasons_done
+        ]
+
+    def changed_units(self, seasons):
+        """
+        Method that compares the data of some seasons with the manifest and returns the (Season, RaceNumber) races that changed.
+        The manifest is updated with the new hashes.
+        """
+        current = {}
+        current.update(spider_hashes(seasons, self.store_format))
+        current.update(procesado_hashes(seasons))
+
+        units = set()
+        for key in set(current) | {
+            key for key in self.units if int(key.split("/")[1]) in seasons
+        }:
+            if current.get(key) != self.units.get(key):
+                _, season, race = key.split("/")
+                units.add((int(season), int(race)))
+                if key in current:
+                    self.units[key] = current[key]
+                else:
+                    del self.units[key]
+        return units
+
+    def save(self):
+        """
+        Method that writes the manifest to disk.
+        """
+        with open(self.path + ".tmp", "w", encoding="utf-8") as fich:
+            fich.write(
+                json.dumps(
+                    {
+                        "store_format": self.store_format,
+                        "units": self.units,
+                        "seasons_done": self.seasons_done,
+                    },
+                    indent=4,
+                )
+            )
+        os.replace(self.path + ".tmp", self.path)
+
+
+def spider_hashes(seasons, store_format="csv"):
+    """
+    Function that returns {"spider/season/race": hash} for the races of the results store of some seasons.
+    """
+    df = get_storage(store_format).read_dataset(
+        dataset_path(spider_store_path, store_format), seasons=seasons
+    )
+    if not len(df):
+        return {}
+    return {
+        f"spider/{season}/{race}": hashlib.sha256(
+            pd.util.hash_pandas_object(df_race, index=False).to_numpy().tobytes()
+        ).hexdigest()
+        for (season, race), df_race in df.groupby(["Season", "RaceNumber"])
+    }
+
+
+def procesado_hashes(seasons):
+    """
+    Function that returns {"pitstops/season/race": hash} for the processed Ergast files of some seasons.
+    """
+    hashes = {}
+    for season in seasons:
+        season_path = os.path.join(procesado_path, str(season))
+        if not os.path.exists(season_path):
+            continue
+        for csv in os.listdir(season_path):
+            busqueda = re.search(patron_procesado, csv)
+            if busqueda != None:
+                key = f"pitstops/{busqueda.group(1)}/{busqueda.group(2)}"
+                hashes[key] = file_hash(os.path.join(season_path, csv))
+    return hashes
+
+
+def file_hash(path):
+    """
+    Function that returns the SHA-256 of the content of a file.
+    """
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def run_incremental(anno_inicial, anno_final, format="csv", store_format="csv"):
+    """
+    Function that updates the merged dataframe processing only the new or changed races.
+    """
+    os.makedirs(cache_path, exist_ok=True)
+    manifest = Manifest(store_format=store_format)
+    seasons = manifest.pending_seasons(anno_inicial, anno_final)
+
+    terminadas = set()
+    if seasons:
+        # The heavy modules are only needed if there is something to download
+        from formula1_spider import run_crawler
+        from ergast_pitstops_data import crear_csv_dataframes_intervalos
+
+        # Get contents from wikipedia using Scrapy
+        crawl_terminado = run_crawler(seasons, store_format=store_format) == "finished"
+
+        # Get data from Ergast F1 Api
+        for anno in seasons:
+            try:
+                crear_csv_dataframes_intervalos(anno, anno)
+            except Exception as error:
+                print(f"Ergast download of season {anno} failed: {error}")
+                continue
+            if crawl_terminado:
+                terminadas.add(anno)
+
+    units = manifest.changed_units(seasons)
+    if units or not os.path.exists(dataset_path("dataframe", format)):
+        df = update_df(units, format, store_format)
+    else:
+        df = load_df(format=format)
+
+    # Finished seasons will not change anymore, once they have been crawled and downloaded completely
+    manifest.seasons_done = sorted(
+        set(manifest.seasons_done)
+        | {anno for anno in terminadas if anno < datetime.date.today().year}
+    )
+    manifest.save()
+
+    return df, units
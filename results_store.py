@@ -0,0 +1,206 @@
+"""
+results_store.py
+
+Adquisición de datos - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Integrantes del grupo:
+    - Lydia Ruiz
+    - David Tarrasa
+    - Jorge Vančo
+    - Alberto Velasco
+
+Descripción:
+Almacén en memoria de los resultados de las carreras con tipos normalizados e índice por (Season, RaceNumber, Driver)"""
+
+import numpy as np
+import pandas as pd
+from dataframe import get_df, get_procesado, load_df
+
+
+# Index of the store, sorted so that seasons and races are contiguous slices.
+INDEX_COLUMNS = ["Season", "RaceNumber", "Driver"]
+
+# Type of every known column of the store. Non numeric grid positions (pit lane) become NA.
+STORE_DTYPES = {
+    "Pos": "category",
+    "DriverNumber": "Int16",
+    "Constructor": "category",
+    "Laps": "Int16",
+    "Time/Retired": "category",
+    "GapSeconds": "float32",
+    "LapsDown": "Int16",
+    "RetirementReason": "category",
+    "Grid": "Int8",
+    "Points": "float32",
+    "RaceName": "category",
+    "driverId": "category",
+    "DriverKey": "Int32",
+    "ConstructorKey": "Int32",
+    "NPitstops": "Int8",
+    "MedianPitStopDuration": "float32",
+    "MeanPitStopDuration": "float32",
+    "MinPitStopDuration": "float32",
+    "TotalPitStopDuration": "float32",
+}
+
+
+def normalize_store_types(df) -> pd.DataFrame:
+    """
+    Function that returns a copy of the DataFrame with the compact dtypes of the store.
+    """
+    df = df.copy()
+    for col, dtype in STORE_DTYPES.items():
+        if col not in df.columns:
+            continue
+        if dtype == "category":
+            df[col] = df[col].astype("category")
+        else:
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype(dtype)
+    return df
+
+
+class RaceResultsStore:
+    """
+    Class that keeps the results of the races indexed by (Season, RaceNumber, Driver).
+    Lookups of a row use the hash table of the index and seasons and races are slices of the sorted index.
+    """
+
+    def __init__(self, df):
+        df = normalize_store_types(df)
+        df["Season"] = df["Season"].astype("int16")
+        df["RaceNumber"] = df["RaceNumber"].astype("int16")
+        df["Driver"] = df["Driver"].astype("category")
+        self.df = df.set_index(INDEX_COLUMNS).sort_index()
+        self.drivers = None
+
+    @classmethod
+    def from_frames(cls, df_results, df_procesado=None):
+        """
+        Method that builds the store from the Wikipedia results and joins the Ergast pit-stop aggregates.
+        """
+        store = cls(df_results)
+        if df_procesado is not None and len(df_procesado):
+            store.join_pitstops(df_procesado)
+        return store
+
+    @classmethod
+    def from_merged(cls, df):
+        """
+        Method that builds the store from the merged dataframe written by create_df.
+        """
+        if "DriverNumber_x" in df.columns:
+            df = df.assign(
+                DriverNumber=df["DriverNumber_x"].fillna(df["DriverNumber_y"])
+            ).drop(columns=["DriverNumber_x", "DriverNumber_y"])
+        return cls(df)
+
+    def join_pitstops(self, df_procesado):
+        """
+        Method that adds or replaces the pit-stop aggregates of some races aligning them by the index.
+        Rows of drivers without a classification row are added, as in the outer merge of merge_dfs.
+        """
+        pitstops = df_procesado.drop(columns="DriverNumber", errors="ignore")
+        pitstops = normalize_store_types(pitstops)
+        pitstops["Season"] = pitstops["Season"].astype("int16")
+        pitstops["RaceNumber"] = pitstops["RaceNumber"].astype("int16")
+        pitstops = pitstops.set_index(INDEX_COLUMNS)
+
+        new_rows = pitstops.index.difference(self.df.index)
+        if len(new_rows):
+            self.df = self.reindex(self.df.index.append(new_rows))
+
+        posiciones = self.df.index.get_indexer(pitstops.index)
+        for col in pitstops.columns:
+            nuevos = pitstops[col]
+            if col not in self.df.columns:
+                self.df[col] = pd.Series(index=self.df.index, dtype=nuevos.dtype)
+            actual = self.df[col]
+            if isinstance(nuevos.dtype, pd.CategoricalDtype):
+                categorias = actual.cat.categories.union(nuevos.cat.categories)
+                actual = actual.cat.set_categories(categorias)
+                nuevos = nuevos.cat.set_categories(categorias)
+            valores = actual.array.copy()
+            valores[posiciones] = nuevos.array
+            self.df[col] = valores
+        self.drivers = None
+
+    def reindex(self, index):
+        """
+        Method that returns the rows of the store for a new index, sorted and with Driver as a category.
+        """
+        df = self.df.reindex(index)
+        driver = index.get_level_values("Driver").astype("category")
+        df.index = pd.MultiIndex.from_arrays(
+            [
+                index.get_level_values("Season"),
+                index.get_level_values("RaceNumber"),
+                driver,
+            ],
+            names=INDEX_COLUMNS,
+        )
+        return df.sort_index()
+
+    def get(self, season, race, driver):
+        """
+        Method that returns the row of a driver in a race, or None.
+        """
+        try:
+            return self.df.loc[(season, race, driver)]
+        except KeyError:
+            return None
+
+    def value(self, season, race, driver, column):
+        """
+        Method that returns a single value of a driver in a race without building the whole row.
+        """
+        return self.df[column].array[self.df.index.get_loc((season, race, driver))]
+
+    def race(self, season, race):
+        """
+        Method that returns the rows of a race.
+        """
+        return self.df.loc[(season, race)]
+
+    def season(self, season):
+        """
+        Method that returns the rows of a season, or of a range of seasons if a slice is given.
+        """
+        if isinstance(season, slice):
+            return self.df.loc[season]
+        return self.df.loc[[season]]
+
+    def driver(self, driver):
+        """
+        Method that returns every row of a driver (the career), using the positions of each driver computed once.
+        """
+        if self.drivers is None:
+            pilotos = self.df.index.get_level_values("Driver")
+            self.drivers = (
+                pd.Series(np.arange(len(pilotos)))
+                .groupby(np.asarray(pilotos), sort=False)
+                .indices
+            )
+        return self.df.iloc[self.drivers.get(driver, [])]
+
+    def memory_usage(self):
+        """
+        Method that returns the bytes used by the store, index included.
+        """
+        return int(self.df.memory_usage(deep=True).sum())
+
+
+def build_results_store(store_format="csv"):
+    """
+    Function that builds the store from the results of the spider and the processed Ergast files.
+    """
+    return RaceResultsStore.from_frames(
+        get_df(store_format=store_format), get_procesado()
+    )
+
+
+def load_results_store(format="csv"):
+    """
+    Function that builds the store from the merged dataframe saved by create_df.
+    """
+    return RaceResultsStore.from_merged(load_df(format=format))
@@ -0,0 +1,350 @@
+"""
+storage.py
+
+Adquisición de datos - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Integrantes del grupo:
+    - Lydia Ruiz
+    - David Tarrasa
+    - Jorge Vančo
+    - Alberto Velasco
+
+Descripción:
+Almacenamiento de los DataFrames del proyecto en CSV o en formatos columnares (Parquet y Arrow IPC) particionados por temporada"""
+
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+# pyarrow is only needed by the columnar formats, so it is imported the first time one is used
+pa = None
+ds = None
+
+
+# Type of every known column once the data has been cleaned.
+INT_COLUMNS = ["Season", "RaceNumber"]
+FLOAT_COLUMNS = ["Laps", "Points", "NPitstops", "MedianPitStopDuration", "GapSeconds"]
+CATEGORY_COLUMNS = ["Driver", "Constructor", "RaceName", "driverId", "RetirementReason"]
+
+
+def normalize_types(df) -> pd.DataFrame:
+    """
+    Function that returns a copy of the DataFrame with numeric and categorical dtypes instead of text.
+    """
+    df = df.copy()
+    for col in INT_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype("Int64")
+    for col in FLOAT_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    for col in df.columns:
+        if df[col].dtype == object:
+            df[col] = df[col].astype("string")
+    return df
+
+
+def import_pyarrow(format):
+    """
+    Function that imports pyarrow the first time that a columnar format is used.
+    """
+    global pa, ds
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.dataset
+        except ImportError:
+            raise ImportError(
+                f"pyarrow is required to store the data in {format} format"
+            )
+        pa, ds = pyarrow, pyarrow.dataset
+
+
+class CSVStorage:
+    """
+    Class that stores a DataFrame in a single CSV file, or a dataset as CSV files partitioned by Season.
+    """
+
+    extension = ".csv"
+
+    def write(self, df, path):
+        """
+        Method that writes the DataFrame to the CSV file.
+        """
+        df.to_csv(path, index=False)
+
+    def read(self, path, columns=None, seasons=None):
+        """
+        Method that reads the CSV file, optionally only some columns and seasons.
+        """
+        if columns is not None and seasons is not None and "Season" not in columns:
+            df = pd.read_csv(path, usecols=list(columns) + ["Season"])
+            return df[df["Season"].isin(seasons)][list(columns)]
+        df = pd.read_csv(path, usecols=columns)
+        if seasons is not None:
+            df = df[df["Season"].isin(seasons)]
+        return df
+
+    def write_partitions(self, df, path, name):
+        """
+        Method that adds a batch of rows to a dataset, one file called name per season (Season=2012/name.csv).
+        """
+        for season, df_season in df.groupby("Season", sort=False):
+            season_path = os.path.join(path, f"Season={season}")
+            os.makedirs(season_path, exist_ok=True)
+            df_season.to_csv(
+                os.path.join(season_path, name + self.extension), index=False
+            )
+
+    def read_dataset(self, path, columns=None, seasons=None):
+        """
+        Method that reads the files of a dataset, optionally only some columns and seasons.
+        """
+        dfs = []
+        for season_dir in sorted(os.listdir(path)) if os.path.exists(path) else []:
+            season = season_dir.partition("=")[2]
+            if seasons is not None and int(season) not in seasons:
+                continue
+            season_path = os.path.join(path, season_dir)
+            for csv in sorted(os.listdir(season_path)):
+                dfs.append(pd.read_csv(os.path.join(season_path, csv), usecols=columns))
+        return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
+
+
+class ArrowDatasetStorage:
+    """
+    Class that stores a DataFrame as a columnar dataset partitioned by Season.
+    """
+
+    def __init__(self, format):
+        import_pyarrow(format)
+        self.format = format
+        self.extension = ".parquet" if format == "parquet" else ".arrow"
+
+    def write(self, df, path):
+        """
+        Method that writes the DataFrame, one directory per season (Season=2012/...).
+        The new version replaces the old one once it has been completely written.
+        """
+        table = pa.Table.from_pandas(normalize_types(df), preserve_index=False)
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        ds.write_dataset(
+            table,
+            tmp_path,
+            format="ipc" if self.format == "arrow" else "parquet",
+            partitioning=["Season"],
+            partitioning_flavor="hive",
+        )
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    def read(self, path, columns=None, seasons=None):
+        """
+        Method that reads only the requested columns and seasons of the dataset.
+        """
+        dataset = ds.dataset(
+            path,
+            format="ipc" if self.format == "arrow" else "parquet",
+            partitioning="hive",
+        )
+        filtro = ds.field("Season").isin(list(seasons)) if seasons is not None else None
+        table = dataset.to_table(columns=columns, filter=filtro)
+        return table.to_pandas()
+
+    def write_partitions(self, df, path, name):
+        """
+        Method that adds a batch of rows to a dataset, one file called name per season (Season=2012/name-0.parquet).
+        """
+        table = pa.Table.from_pandas(normalize_types(df), preserve_index=False)
+        ds.write_dataset(
+            table,
+            path,
+            format="ipc" if self.format == "arrow" else "parquet",
+            partitioning=["Season"],
+            partitioning_flavor="hive",
+            basename_template=name + "-{i}" + self.extension,
+            existing_data_behavior="overwrite_or_ignore",
+        )
+
+    def read_dataset(self, path, columns=None, seasons=None):
+        """
+        Method that reads the files of a dataset, optionally only some columns and seasons.
+        """
+        if not os.path.exists(path):
+            return pd.DataFrame()
+        return self.read(path, columns, seasons)
+
+
+class SnapshotStorage:
+    """
+    Class that stores a DataFrame as a versioned snapshot of NumPy arrays that readers memory-map, with no parsing
+    and no copy: fixed-width numeric columns (with a mask for missing integers) and dictionary-encoded strings.
+    Every write creates a new version directory and then points CURRENT to it with an atomic rename, so the
+    readers that are still using the previous version are not blocked and keep reading it.
+    """
+
+    extension = ".snapshot"
+
+    # Versions kept on disk, so that readers of the previous version can still open its files.
+    versions_kept = 2
+
+    def current_version(self, path):
+        """
+        Method that returns the name of the version that CURRENT points to, or None.
+        """
+        current_path = os.path.join(path, "CURRENT")
+        if not os.path.exists(current_path):
+            return None
+        with open(current_path, "r", encoding="utf-8") as fich:
+            return fich.read().strip()
+
+    def write(self, df, path):
+        """
+        Method that writes the DataFrame as a new version of the snapshot and makes it the current one.
+        """
+        os.makedirs(path, exist_ok=True)
+        anterior = self.current_version(path)
+        version = f"v{int(anterior[1:]) + 1 if anterior else 1:06d}"
+        version_path = os.path.join(path, version)
+        shutil.rmtree(version_path, ignore_errors=True)
+        os.makedirs(version_path)
+
+        columnas = []
+        for i, col in enumerate(df.columns):
+            serie = df[col]
+            columna = {"name": col}
+            if pd.api.types.is_bool_dtype(serie.dtype) and not serie.hasnans:
+                columna["kind"] = "numeric"
+                valores = serie.to_numpy(dtype=np.bool_)
+            elif pd.api.types.is_integer_dtype(serie.dtype) and isinstance(
+                serie.dtype, pd.api.extensions.ExtensionDtype
+            ):
+                # Nullable integers (Int16, Int64...) keep their values and a mask of missing values
+                columna["kind"] = "integer"
+                mascara = serie.isna().to_numpy()
+                dtype = getattr(serie.dtype, "numpy_dtype", serie.dtype)
+                valores = serie.fillna(0).to_numpy(dtype=dtype)
+                np.save(os.path.join(version_path, f"{i}.mask.npy"), mascara)
+            elif pd.api.types.is_numeric_dtype(serie.dtype):
+                columna["kind"] = "numeric"
+                dtype = getattr(serie.dtype, "numpy_dtype", serie.dtype)
+                valores = serie.to_numpy(dtype=dtype, na_value=np.nan)
+            else:
+                # Any other column is dictionary-encoded: codes (-1 is missing) and its categories.
+                # The codes keep the width chosen by pandas (int8 up to 127 categories...) so they are not copied
+                columna["kind"] = "dictionary"
+                categorica = pd.Categorical(serie)
+                columna["categories"] = categorica.categories.tolist()
+                valores = categorica.codes
+            np.save(os.path.join(version_path, f"{i}.npy"), valores)
+            columnas.append(columna)
+
+        with open(
+            os.path.join(version_path, "columns.json"), "w", encoding="utf-8"
+        ) as fich:
+            json.dump({"rows": len(df), "columns": columnas}, fich, default=str)
+
+        # The new version is published at once by replacing CURRENT
+        current_path = os.path.join(path, "CURRENT")
+        with open(current_path + ".tmp", "w", encoding="utf-8") as fich:
+            fich.write(version)
+        os.replace(current_path + ".tmp", current_path)
+
+        # Old versions are removed; files already memory-mapped by a reader remain valid until it closes them
+        versiones = sorted(
+            nombre for nombre in os.listdir(path) if nombre.startswith("v")
+        )
+        for nombre in versiones[: -self.versions_kept]:
+            shutil.rmtree(os.path.join(path, nombre), ignore_errors=True)
+
+    def read(self, path, columns=None, seasons=None):
+        """
+        Method that memory-maps the requested columns of the current version (read only), optionally only some seasons.
+        Once mapped, the columns stay valid even if the version is removed. If the version being loaded is removed
+        first (two writes while it is read), the read starts again from the new current version.
+        """
+        while True:
+            version = self.current_version(path)
+            if version is None:
+                raise FileNotFoundError(
+                    f"No snapshot in {path}: {os.path.join(path, 'CURRENT')} does not exist"
+                )
+            try:
+                return self.read_version(os.path.join(path, version), columns, seasons)
+            except FileNotFoundError:
+                if self.current_version(path) == version:
+                    raise
+
+    def read_version(self, version_path, columns=None, seasons=None):
+        """
+        Method that memory-maps the requested columns of a version of the snapshot, optionally only some seasons.
+        """
+        with open(
+            os.path.join(version_path, "columns.json"), "r", encoding="utf-8"
+        ) as fich:
+            manifiesto = json.load(fich)
+
+        datos = {}
+        for i, columna in enumerate(manifiesto["columns"]):
+            nombre = columna["name"]
+            if columns is not None and nombre not in columns and nombre != "Season":
+                continue
+            valores = np.load(os.path.join(version_path, f"{i}.npy"), mmap_mode="r")
+            if columna["kind"] == "integer":
+                mascara = np.load(
+                    os.path.join(version_path, f"{i}.mask.npy"), mmap_mode="r"
+                )
+                datos[nombre] = pd.arrays.IntegerArray(valores, mascara)
+            elif columna["kind"] == "dictionary":
+                datos[nombre] = pd.Categorical.from_codes(
+                    valores, categories=columna["categories"], validate=False
+                )
+            else:
+                datos[nombre] = valores
+        df = pd.DataFrame(datos, copy=False)
+
+        if seasons is not None:
+            df = df[pd.Series(df["Season"]).isin(list(seasons)).to_numpy()]
+        if columns is not None:
+            df = df[list(columns)]
+        return df
+
+
+def get_storage(format="csv"):
+    """
+    Function that returns the storage backend of a format: csv, parquet, arrow or snapshot.
+    """
+    if format == "csv":
+        return CSVStorage()
+    if format in ["parquet", "arrow"]:
+        return ArrowDatasetStorage(format)
+    if format == "snapshot":
+        return SnapshotStorage()
+    raise ValueError(f"Unknown storage format: {format}")
+
+
+def replace_partitions(staging_path, path):
+    """
+    Function that moves the season directories of a staging dataset into a dataset,
+    replacing the seasons that already existed.
+    """
+    os.makedirs(path, exist_ok=True)
+    for season_dir in os.listdir(staging_path):
+        destination = os.path.join(path, season_dir)
+        shutil.rmtree(destination, ignore_errors=True)
+        os.replace(os.path.join(staging_path, season_dir), destination)
+    shutil.rmtree(staging_path, ignore_errors=True)
+
+
+def dataset_path(name, format="csv"):
+    """
+    Function that returns the path of a dataset stored with a format.
+    """
+    return name + get_storage(format).extension
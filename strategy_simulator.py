@@ -0,0 +1,255 @@
+"""
+strategy_simulator.py
+
+Adquisición de datos - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Integrantes del grupo:
+    - Lydia Ruiz
+    - David Tarrasa
+    - Jorge Vančo
+    - Alberto Velasco
+
+Descripción:
+Simulación de Monte Carlo de estrategias de pit-stops: a partir del DataFrame cruzado se simulan miles de carreras
+de un circuito con distinto número de paradas por equipo, vectorizadas con NumPy y repartidas entre varios procesos
+
+Uso: python main.py simulate --circuit "Bahrain Grand Prix" [--season 2023] [--trials 100000] [--stops 1 2 3] [--seed 0]"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from dataframe import load_df
+from metrics import obtener_metricas
+
+
+# Columns of the merged dataframe used by the simulator.
+SIMULATION_COLUMNS = [
+    "Constructor",
+    "RaceName",
+    "Season",
+    "Laps",
+    "NPitstops",
+    "MedianPitStopDuration",
+    "GapSeconds",
+]
+
+# Time lost to tyre wear (seconds per lap squared of a stint): a stint of L laps loses DEGRADACION * L**2 / 2.
+DEGRADACION = 0.05
+
+# Standard deviation (seconds) of the pace of a team from one race to another.
+RUIDO = 5.0
+
+# Trials simulated by each task of the process pool. The seeds depend on the chunks, not on the processes,
+# so a seed always gives the same result whatever the number of processes.
+TRIALS_POR_BLOQUE = 25_000
+
+
+def load_simulation_df(format="csv"):
+    """
+    Function that reads from the saved merged dataframe only the columns needed by the simulator.
+    """
+    return load_df(columns=SIMULATION_COLUMNS, format=format)
+
+
+def tyre_cost(stops, laps, degradacion=DEGRADACION):
+    """
+    Function that returns the time lost to tyre wear in a race of some laps split into stops + 1 equal stints.
+    """
+    stints = np.asarray(stops) + 1
+    return degradacion * laps**2 / (2 * stints)
+
+
+def build_model(df, circuit, season=None, degradacion=DEGRADACION, ruido=RUIDO):
+    """
+    Function that builds the model of the race of a circuit in a season (the latest one by default) from the merged
+    dataframe, as a dictionary of NumPy arrays that can be sent to the worker processes:
+    - the pace of every team of that race without pit stops nor tyre wear (the median gap of its drivers to the
+      winner, minus the cost of its strategy),
+    - its number of stops in that race,
+    - the pit-stop durations of every team in every race of every season, from which the simulated stops are drawn.
+    """
+    df = df.assign(
+        Constructor=df["Constructor"].astype(str),
+        RaceName=df["RaceName"].astype(str),
+        MedianPitStopDuration=pd.to_numeric(df["MedianPitStopDuration"]),
+        NPitstops=pd.to_numeric(df["NPitstops"]),
+        GapSeconds=pd.to_numeric(df["GapSeconds"]),
+        Laps=pd.to_numeric(df["Laps"]),
+    )
+    carreras = df[df["RaceName"] == circuit]
+    if not len(carreras):
+        raise ValueError(f"Unknown circuit: {circuit}")
+    season = int(carreras["Season"].max()) if season is None else season
+    carrera = carreras[carreras["Season"] == season]
+    if not len(carrera):
+        raise ValueError(f"No race at {circuit} in {season}")
+    vueltas = float(carrera["Laps"].max())
+
+    # Teams of the race, with the durations of their stops in every race
+    equipos = carrera.groupby("Constructor", observed=True).agg(
+        gap=("GapSeconds", "median"), paradas=("NPitstops", "median")
+    )
+    duraciones = (
+        df.dropna(subset="MedianPitStopDuration")
+        .groupby("Constructor", observed=True)["MedianPitStopDuration"]
+        .apply(lambda serie: serie.to_numpy(dtype=np.float64))
+    )
+    equipos = equipos[equipos.index.isin(duraciones.index)]
+    if not len(equipos):
+        raise ValueError(f"No pit stops recorded at {circuit} in {season}")
+
+    # Teams that were lapped or retired every time start behind the slowest team
+    gap = equipos["gap"].fillna(equipos["gap"].max()).fillna(0).to_numpy()
+    paradas = equipos["paradas"].fillna(1).round().clip(lower=0).to_numpy(np.int64)
+    muestras = [duraciones[equipo] for equipo in equipos.index]
+    duracion_media = np.array([muestra.mean() for muestra in muestras])
+    ritmo = gap - paradas * duracion_media - tyre_cost(paradas, vueltas, degradacion)
+
+    return {
+        "circuit": circuit,
+        "season": season,
+        "teams": np.array(equipos.index, dtype=str),
+        "laps": vueltas,
+        "pace": ritmo,
+        "usual_stops": paradas,
+        "durations": np.concatenate(muestras),
+        "offsets": np.cumsum([0] + [len(muestra) for muestra in muestras[:-1]]),
+        "counts": np.array([len(muestra) for muestra in muestras]),
+        "degradacion": degradacion,
+        "ruido": ruido,
+    }
+
+
+def simulate_chunk(modelo, stops, trials, semilla):
+    """
+    Function that simulates some races of a circuit with a seed and returns, for every team and number of
+    stops (tried by that team while the others keep their usual strategy), the sums of the race time,
+    the finishing position, the wins and the podiums.
+    All the trials are simulated at once: arrays of trials x teams (x stops).
+    """
+    rng = np.random.default_rng(semilla)
+    equipos = len(modelo["teams"])
+    stops = np.asarray(stops)
+    max_paradas = max(int(stops.max()), int(modelo["usual_stops"].max()))
+
+    # Durations of every stop drawn from the stops of each team, and the time lost after each number of stops
+    indices = modelo["offsets"][:, None] + (
+        rng.random((trials, equipos, max_paradas)) * modelo["counts"][:, None]
+    ).astype(np.int64)
+    perdida = np.concatenate(
+        [
+            np.zeros((trials, equipos, 1)),
+            np.cumsum(modelo["durations"][indices], axis=2),
+        ],
+        axis=2,
+    )
+    ritmo = modelo["pace"] + rng.normal(0, modelo["ruido"], (trials, equipos))
+
+    # Race time of every team with its usual strategy and with every number of stops tried
+    neumaticos = tyre_cost(
+        np.arange(max_paradas + 1), modelo["laps"], modelo["degradacion"]
+    )
+    habitual = np.take_along_axis(
+        perdida,
+        np.broadcast_to(modelo["usual_stops"][None, :, None], (trials, equipos, 1)),
+        2,
+    )[:, :, 0]
+    campo = ritmo + habitual + neumaticos[modelo["usual_stops"]]
+    tiempos = ritmo[:, :, None] + perdida[:, :, stops] + neumaticos[stops]
+
+    # Position of a team: 1 + rivals (with their usual strategy) that finish ahead
+    delante = campo[:, None, :, None] < tiempos[:, :, None, :]
+    delante[:, np.arange(equipos), np.arange(equipos), :] = False
+    posiciones = 1 + delante.sum(axis=2)
+
+    return {
+        "time": tiempos.sum(axis=0),
+        "position": posiciones.sum(axis=0),
+        "wins": (posiciones == 1).sum(axis=0),
+        "podiums": (posiciones <= 3).sum(axis=0),
+    }
+
+
+def simulate_strategies(
+    df,
+    circuit,
+    season=None,
+    stops=(1, 2, 3),
+    trials=100_000,
+    seed=0,
+    max_workers=None,
+    **model,
+):
+    """
+    Function that simulates trials races of a circuit in a season (the latest one by default) for every team of
+    that race and number of stops, in a process pool.
+    Returns one row per (Constructor, Stops) with the mean race time relative to the winner's pace, the expected
+    position and the probabilities of winning and of a podium. The same seed always gives the same result.
+    """
+    if trials < 1:
+        raise ValueError(f"trials must be 1 or more: {trials}")
+    if any(parada < 0 for parada in stops):
+        raise ValueError(f"stops must be 0 or more: {list(stops)}")
+    metricas = obtener_metricas()
+    with metricas.stage("simulate.model", circuit=circuit):
+        modelo = build_model(df, circuit, season, **model)
+
+    bloques = [
+        min(TRIALS_POR_BLOQUE, trials - inicio)
+        for inicio in range(0, trials, TRIALS_POR_BLOQUE)
+    ]
+    semillas = np.random.SeedSequence(seed).spawn(len(bloques))
+
+    with metricas.stage("simulate.trials", circuit=circuit, trials=trials):
+        # With a single worker (or a single chunk) the trials are simulated in this process
+        if max_workers == 1 or len(bloques) == 1:
+            parciales = [
+                simulate_chunk(modelo, stops, bloque, semilla)
+                for bloque, semilla in zip(bloques, semillas)
+            ]
+        else:
+            # spawn, as in ergast_pitstops_data, so the workers do not inherit the threads of the process
+            contexto = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(
+                max_workers=max_workers or os.cpu_count(), mp_context=contexto
+            ) as executor:
+                parciales = list(
+                    executor.map(
+                        simulate_chunk,
+                        [modelo] * len(bloques),
+                        [stops] * len(bloques),
+                        bloques,
+                        semillas,
+                    )
+                )
+    metricas.count("simulate.trials", trials)
+
+    totales = {
+        clave: sum(parcial[clave] for parcial in parciales) for clave in parciales[0]
+    }
+    equipos, paradas = np.meshgrid(modelo["teams"], np.asarray(stops), indexing="ij")
+    return pd.DataFrame(
+        {
+            "Season": modelo["season"],
+            "Constructor": equipos.ravel(),
+            "Stops": paradas.ravel(),
+            "UsualStops": np.repeat(modelo["usual_stops"], len(stops)),
+            "MeanTime": (totales["time"] / trials).ravel(),
+            "ExpectedPosition": (totales["position"] / trials).ravel(),
+            "WinProbability": (totales["wins"] / trials).ravel(),
+            "PodiumProbability": (totales["podiums"] / trials).ravel(),
+        }
+    )
+
+
+def best_strategies(resultados):
+    """
+    Function that returns, for every team, the number of stops with the best expected position.
+    """
+    mejores = resultados.loc[
+        resultados.groupby("Constructor")["ExpectedPosition"].idxmin()
+    ]
+    return mejores.sort_values("ExpectedPosition").reset_index(drop=True)
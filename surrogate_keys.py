@@ -0,0 +1,103 @@
+"""
+surrogate_keys.py
+
+Adquisición de datos - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Integrantes del grupo:
+    - Lydia Ruiz
+    - David Tarrasa
+    - Jorge Vančo
+    - Alberto Velasco
+
+Descripción:
+Claves enteras compactas (int32) para pilotos, escuderías y carreras, asignadas al leer los datos de Wikipedia y
+Ergast, de modo que los cruces y agrupaciones se hacen sobre enteros y el texto solo se recupera al guardar"""
+
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+
+keys_path = os.path.join("cache", "keys")
+
+
+class KeyDictionary:
+    """
+    Class that assigns an int32 id to every value of a dimension (drivers, constructors...).
+    Values are appended to a JSON lines file in the order they are first seen, so the ids never change between runs.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.values = []
+        self.ids = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as fich:
+                for linea in fich:
+                    if linea.strip():
+                        valor = json.loads(linea)
+                        self.ids[valor] = len(self.values)
+                        self.values.append(valor)
+
+    def __len__(self):
+        return len(self.values)
+
+    def encode(self, values) -> np.ndarray:
+        """
+        Method that returns the ids of some values (-1 for missing values), registering the new ones.
+        Only the distinct values are looked up, the rows are mapped with their factorized codes.
+        """
+        codigos, unicos = pd.factorize(pd.Series(values, dtype=object), sort=False)
+        with self.lock:
+            nuevos = [valor for valor in unicos if valor not in self.ids]
+            if nuevos:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as fich:
+                    for valor in nuevos:
+                        fich.write(json.dumps(valor, ensure_ascii=False) + "\n")
+                        self.ids[valor] = len(self.values)
+                        self.values.append(valor)
+            ids = np.array([self.ids[valor] for valor in unicos], dtype=np.int32)
+        # factorize marks missing values with -1, which is kept as the id of missing values
+        return np.where(codigos >= 0, ids[codigos] if len(ids) else -1, -1).astype(
+            np.int32
+        )
+
+    def decode(self, ids) -> pd.Categorical:
+        """
+        Method that returns the values of some ids as a categorical over the dictionary (-1 becomes missing).
+        No string is created per row, the categorical only keeps the ids.
+        """
+        ids = pd.to_numeric(pd.Series(ids), errors="coerce").fillna(-1)
+        return pd.Categorical.from_codes(
+            ids.to_numpy(dtype=np.int32), categories=pd.Index(self.values, dtype=object)
+        )
+
+
+def race_keys(seasons, race_numbers) -> np.ndarray:
+    """
+    Function that returns the int32 key of every race (Season * 100 + RaceNumber), the same in every source.
+    """
+    return np.asarray(seasons, dtype=np.int32) * 100 + np.asarray(
+        race_numbers, dtype=np.int32
+    )
+
+
+diccionarios = {}
+lock_diccionarios = threading.Lock()
+
+
+def obtener_diccionario(nombre):
+    """
+    Function that returns the key dictionary of a dimension (drivers, constructors) shared by every module.
+    """
+    with lock_diccionarios:
+        if nombre not in diccionarios:
+            diccionarios[nombre] = KeyDictionary(
+                os.path.join(keys_path, f"{nombre}.jsonl")
+            )
+        return diccionarios[nombre]